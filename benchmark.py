@@ -0,0 +1,171 @@
+import os
+import sys
+import time
+import inspect
+import argparse
+import subprocess
+import tracemalloc
+from collections.abc import Mapping
+import pandas as pd
+from olist.data import Olist
+from olist.order import Order
+from olist.seller import Seller
+from olist.product import Product
+from olist.features import get_registry
+
+CLASSES = [Olist, Order, Seller, Product]
+# get_* methods that compute nothing worth timing
+EXCLUDED = ['get_store']
+# modules imported by batch workers, and the packages they should not load
+HEADLESS_MODULES = ['olist.data', 'olist.order', 'olist.seller', 'olist.product', 'olist.export', 'olist.server']
+PLOTTING_PACKAGES = ['matplotlib', 'seaborn', 'statsmodels', 'scipy']
+IMPORT_CODE = """import sys, time
+start = time.perf_counter()
+import %s
+print(time.perf_counter() - start)
+print(' '.join(sorted({name.split('.')[0] for name in sys.modules})))"""
+
+
+def get_benchmarks(classes=None):
+    """
+    Returns a list of (class, method name, kwargs) for every public get_* method of `classes`
+    (CLASSES by default). `get_features` asks for every column of the features
+    get_training_data is built from, other methods with required arguments are left out.
+    """
+    benchmarks = []
+    for cls in CLASSES if classes is None else classes:
+        for name, method in inspect.getmembers(cls, inspect.isfunction):
+            if not name.startswith('get_') or name in EXCLUDED:
+                continue
+            if name == 'get_features':
+                registry = get_registry(cls())
+                columns = [column for dependency in registry['get_training_data'][1] for column in registry[dependency][0]]
+                benchmarks.append((cls, name, {'columns': list(dict.fromkeys(columns))}))
+                continue
+            parameters = list(inspect.signature(method).parameters.values())[1:]
+            if all(p.default is not p.empty or p.kind in (p.VAR_POSITIONAL, p.VAR_KEYWORD) for p in parameters):
+                benchmarks.append((cls, name, {}))
+    return benchmarks
+
+
+def count_rows(result):
+    """
+    Returns the number of rows of `result`, loading every table of a `get_data` mapping.
+    """
+    if isinstance(result, Mapping):
+        return sum(len(df) for df in result.values())
+    return len(result) if hasattr(result, '__len__') else None
+
+
+def run_once(cls, name, kwargs, cold=True):
+    """
+    Calls `cls().name(**kwargs)` on a new object, so memoized features are not reused,
+    after forgetting every parsed table when `cold`. Returns the number of rows of the result.
+    """
+    if cold:
+        Olist().clear_cache()
+    return count_rows(getattr(cls(), name)(**kwargs))
+
+
+def measure(cls, name, kwargs, repeat=1, cold=True, memory=True):
+    """
+    Returns a dict with the best wall-clock 'seconds' of `repeat` runs, the 'peak_mb'
+    allocated during another run (tracemalloc slows the code down, so it is timed apart;
+    buffers allocated by pyarrow are not traced) and the 'rows' of the result.
+    """
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = run_once(cls, name, kwargs, cold)
+        seconds.append(time.perf_counter() - start)
+    peak = None
+    if memory:
+        tracemalloc.start()
+        try:
+            run_once(cls, name, kwargs, cold)
+            peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        finally:
+            tracemalloc.stop()
+    return {'seconds': min(seconds), 'peak_mb': peak, 'rows': rows}
+
+
+def run_benchmarks(classes=None, repeat=1, cold=True, memory=True):
+    """
+    Returns a DataFrame with one row per get_* method of `classes` (see get_benchmarks):
+    'class', 'method', 'seconds', 'peak_mb' and 'rows'.
+    `cold` clears the parsed tables before each run, so reading the data is part of the timings.
+    """
+    results = []
+    for cls, name, kwargs in get_benchmarks(classes):
+        results.append({'class': cls.__name__, 'method': name,
+                        **measure(cls, name, kwargs, repeat, cold, memory)})
+    return pd.DataFrame(results, columns=['class', 'method', 'seconds', 'peak_mb', 'rows'])
+
+
+def compare_benchmarks(baseline, current, threshold=1.2):
+    """
+    Returns the rows of `current` whose 'seconds' or 'peak_mb' grew more than `threshold`
+    times over `baseline` (two run_benchmarks results), with the ratios.
+    """
+    merged = baseline.merge(current, on=['class', 'method'], suffixes=('_baseline', ''))
+    merged['seconds_ratio'] = merged['seconds'] / merged['seconds_baseline']
+    merged['peak_mb_ratio'] = merged['peak_mb'] / merged['peak_mb_baseline']
+    regressed = (merged['seconds_ratio'] > threshold) | (merged['peak_mb_ratio'] > threshold)
+    return merged.loc[regressed, ['class', 'method', 'seconds', 'seconds_ratio', 'peak_mb', 'peak_mb_ratio']]
+
+
+def measure_import(module, repeat=5):
+    """
+    Returns a dict with the best 'seconds' of `repeat` imports of `module`, each in a new interpreter,
+    and the PLOTTING_PACKAGES it 'loaded'.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([root, os.environ.get('PYTHONPATH', '')]))
+    seconds = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', IMPORT_CODE % module], env=env,
+                                capture_output=True, text=True, check=True).stdout.split('\n')
+        seconds.append(float(output[0]))
+    loaded = [package for package in PLOTTING_PACKAGES if package in output[1].split()]
+    return {'seconds': min(seconds), 'loaded': loaded}
+
+
+def run_import_benchmarks(modules=None, repeat=5):
+    """
+    Returns a DataFrame with the import time of each of `modules` (HEADLESS_MODULES by default):
+    'module', 'seconds' and the plotting or statistics packages it 'loaded', which should be none.
+    """
+    results = [{'module': module, **measure_import(module, repeat)}
+               for module in (HEADLESS_MODULES if modules is None else modules)]
+    return pd.DataFrame(results, columns=['module', 'seconds', 'loaded'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the get_* methods of the Olist classes.')
+    parser.add_argument('--data-dir', help='folder of the csv files (sets OLIST_DATA_DIR)')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--warm', action='store_true', help='keep the parsed tables between runs')
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc run')
+    parser.add_argument('--output', help='csv file to write the results to')
+    parser.add_argument('--baseline', help='csv file of earlier results to compare with')
+    parser.add_argument('--imports', action='store_true',
+                        help='time the imports of the headless modules instead, failing if one loads plotting packages')
+    args = parser.parse_args()
+    if args.data_dir:
+        os.environ['OLIST_DATA_DIR'] = args.data_dir
+    if args.imports:
+        results = run_import_benchmarks(repeat=args.repeat if args.repeat > 1 else 5)
+        print(results.to_string(index=False))
+        if args.output:
+            results.to_csv(args.output, index=False)
+        sys.exit(1 if results['loaded'].str.len().any() else 0)
+    results = run_benchmarks(repeat=args.repeat, cold=not args.warm, memory=not args.no_memory)
+    print(results.to_string(index=False))
+    if args.output:
+        results.to_csv(args.output, index=False)
+    if args.baseline:
+        print(compare_benchmarks(pd.read_csv(args.baseline), results).to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+import os
+import json
+import argparse
+import pandas as pd
+from olist.schema import apply_schema, schema_version
+from olist.profiling import stage
+from olist.ids import IdRange
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# rows per row group of the sorted copies, a range read skips the row groups it does not overlap
+SORTED_ROW_GROUP_SIZE = 10000
+
+
+class ColumnarCache:
+    '''
+    Typed columnar copy of the Olist csv files, stored as parquet
+    in a folder next to the csv folder (../data/parquet).
+    A file is converted again as soon as its csv changed on disk (mtime or size)
+    or its declared schema changed.
+    '''
+
+    def __init__(self, csv_path, cache_path=None):
+        self.csv_path = csv_path
+        if cache_path is None:
+            cache_path = os.path.join(os.path.dirname(os.path.normpath(csv_path)), 'parquet')
+        self.cache_path = cache_path
+
+    @staticmethod
+    def is_available():
+        """
+        The cache needs pyarrow and can be turned off with OLIST_COLUMNAR_CACHE=0.
+        """
+        return pyarrow is not None and os.environ.get('OLIST_COLUMNAR_CACHE', '1') != '0'
+
+    def parquet_file(self, file):
+        return os.path.join(self.cache_path, file.replace('.csv', '.parquet'))
+
+    def signature_file(self, file):
+        return os.path.join(self.cache_path, file.replace('.csv', '.json'))
+
+    def signature(self, file):
+        """
+        Returns the mtime and size of the csv `file`, with the version of its schema.
+        """
+        stat = os.stat(os.path.join(self.csv_path, file))
+        return {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size,
+                'schema': schema_version(file)}
+
+    def is_stale(self, file):
+        """
+        True when the parquet copy of `file` is missing or older than its csv.
+        """
+        if not os.path.exists(self.parquet_file(file)):
+            return True
+        try:
+            with open(self.signature_file(file)) as f:
+                return json.load(f) != self.signature(file)
+        except (OSError, ValueError):
+            return True
+
+    def convert(self, file, df):
+        """
+        Applies the declared schema to each csv before it is written as parquet.
+        """
+        return apply_schema(file, df)
+
+    def build(self, file):
+        """
+        Converts the csv `file` into parquet and returns the DataFrame.
+        """
+        os.makedirs(self.cache_path, exist_ok=True)
+        signature = self.signature(file)
+        with stage('read_csv ' + file, 'io') as current:
+            df = current.output(pd.read_csv(os.path.join(self.csv_path, file)))
+        df = self.convert(file, df)
+        # write to temporary files first so concurrent readers never see a partial file
+        tmp = self.parquet_file(file) + '.%d.tmp' % os.getpid()
+        df.to_parquet(tmp, engine='pyarrow', index=False)
+        os.replace(tmp, self.parquet_file(file))
+        tmp = self.signature_file(file) + '.%d.tmp' % os.getpid()
+        with open(tmp, 'w') as f:
+            json.dump(signature, f)
+        os.replace(tmp, self.signature_file(file))
+        return df
+
+    def read(self, file, columns=None, row_filter=None):
+        """
+        Returns the DataFrame for the csv `file`, rebuilding its parquet copy if stale.
+        `row_filter` is a (column, values) pair pushed down to the parquet reader,
+        `values` an IdRange reads the copy of `file` sorted on `column`.
+        """
+        if self.is_stale(file):
+            df = self.build(file)
+            if row_filter is not None:
+                column, values = row_filter
+                mask = values.contains(df[column]) if isinstance(values, IdRange) else df[column].isin(values)
+                df = df[mask].reset_index(drop=True)
+            return df[columns] if columns is not None else df
+        filters = None
+        if row_filter is not None:
+            column, values = row_filter
+            if isinstance(values, IdRange):
+                return pd.read_parquet(self.sorted_file(file, column), engine='pyarrow',
+                                       columns=columns, filters=values.filters() or None)
+            if len(values) == 0:
+                schema = pyarrow.parquet.read_schema(self.parquet_file(file))
+                df = schema.empty_table().to_pandas()
+                return df[columns] if columns is not None else df
+            filters = [(column, 'in', list(values))]
+        return pd.read_parquet(self.parquet_file(file), engine='pyarrow',
+                               columns=columns, filters=filters)
+
+    def iter_batches(self, file, columns, batch_size, sorted_by=None):
+        """
+        Yields the DataFrames of `batch_size` rows of the csv `file`, reading
+        its parquet copy one batch at a time, or its copy sorted on the column `sorted_by`.
+        """
+        if sorted_by is not None:
+            path = self.sorted_file(file, sorted_by)
+        else:
+            if self.is_stale(file):
+                self.build(file)
+            path = self.parquet_file(file)
+        for batch in pyarrow.parquet.ParquetFile(path).iter_batches(batch_size, columns=columns):
+            yield batch.to_pandas()
+
+    def derived_file(self, name, file, build, row_group_size=None):
+        """
+        Returns the path of `name`.parquet, holding the DataFrame `build()` computes
+        from the csv `file`, built again when `file` changed.
+        """
+        path = os.path.join(self.cache_path, name + '.parquet')
+        signature_path = os.path.join(self.cache_path, name + '.json')
+        signature = self.signature(file)
+        try:
+            with open(signature_path) as f:
+                if json.load(f) == signature and os.path.exists(path):
+                    return path
+        except (OSError, ValueError):
+            pass
+        df = build()
+        os.makedirs(self.cache_path, exist_ok=True)
+        tmp = path + '.%d.tmp' % os.getpid()
+        df.to_parquet(tmp, engine='pyarrow', index=False, row_group_size=row_group_size)
+        os.replace(tmp, path)
+        tmp = signature_path + '.%d.tmp' % os.getpid()
+        with open(tmp, 'w') as f:
+            json.dump(signature, f)
+        os.replace(tmp, signature_path)
+        return path
+
+    def read_derived(self, name, file, build):
+        """
+        Returns the DataFrame `build()` computes from the csv `file`,
+        persisted as `name`.parquet and built again when `file` changed.
+        """
+        return pd.read_parquet(self.derived_file(name, file, build), engine='pyarrow')
+
+    def sorted_file(self, file, column):
+        """
+        Returns the path of a copy of the csv `file` sorted on `column`, in row groups of
+        SORTED_ROW_GROUP_SIZE rows whose statistics let range filters on `column` skip the others.
+        """
+        name = file.replace('.csv', '.by_' + column)
+        return self.derived_file(name, file, lambda: self.read(file).sort_values(column, kind='stable',
+                                                                                 ignore_index=True),
+                                 row_group_size=SORTED_ROW_GROUP_SIZE)
+
+    def columns(self, file):
+        """
+        Returns the column names of the csv `file` from its parquet schema.
+        """
+        if self.is_stale(file):
+            self.build(file)
+        return pyarrow.parquet.read_schema(self.parquet_file(file)).names
+
+    def build_all(self, files, force=False):
+        """
+        Prebuilds the parquet copy of every csv in `files`.
+        Returns the list of files converted.
+        """
+        built = []
+        for file in files:
+            if force or self.is_stale(file):
+                self.build(file)
+                built.append(file)
+        return built
+
+
+def main():
+    from olist.data import Olist
+    parser = argparse.ArgumentParser(description='Prebuild the parquet cache of the Olist csv files.')
+    parser.add_argument('--force', action='store_true', help='rebuild files that are up to date')
+    args = parser.parse_args()
+    olist = Olist()
+    cache = olist.get_store().cache
+    if cache is None:
+        parser.error('the columnar cache needs pyarrow')
+    for file in cache.build_all(olist.FILE_NAMES, force=args.force):
+        print('built', cache.parquet_file(file))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+from olist.data import Olist
+from olist.profiling import profiled_merge
+
+DIMENSIONS = ['category', 'seller_state', 'purchase_month']
+MEASURES = ['price', 'freight_value', 'wait_time', 'review_score']
+AGGS = ['count', 'sum', 'mean', 'var', 'std', 'min', 'max', 'median']
+# relative accuracy of the quantiles given by the sketches
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+# the files the facts are read from, the cube is rebuilt when one of them changed
+FILES = ['olist_orders_dataset.csv', 'olist_order_items_dataset.csv', 'olist_order_reviews_dataset.csv',
+         'olist_products_dataset.csv', 'product_category_name_translation.csv', 'olist_sellers_dataset.csv']
+
+
+def get_facts():
+    """
+    Returns a DataFrame with one row per order item: its 'category', 'seller_state',
+    'purchase_month', and its 'price', 'freight_value', the 'wait_time' of its order
+    (delivered orders only) and the mean 'review_score' of its order.
+    """
+    data = Olist().get_data(interned=True, columns={
+        'orders': ['order_id', 'order_status', 'order_purchase_timestamp', 'order_delivered_customer_date'],
+        'order_items': ['order_id', 'product_id', 'seller_id', 'price', 'freight_value'],
+        'order_reviews': ['order_id', 'review_score'],
+        'products': ['product_id', 'product_category_name'],
+        'sellers': ['seller_id', 'seller_state'],
+    })
+    orders = data['orders']
+    wait_time = (orders['order_delivered_customer_date'] - orders['order_purchase_timestamp']) / np.timedelta64(24, 'h')
+    orders = pd.DataFrame({'order_id': orders['order_id'],
+                           'purchase_month': orders['order_purchase_timestamp'].dt.to_period('M').dt.to_timestamp(),
+                           'wait_time': wait_time.where(orders['order_status'] == 'delivered')})
+    reviews = data['order_reviews'].groupby('order_id', as_index=False)['review_score'].mean()
+    products = profiled_merge(data['products'], data['product_category_name_translation'], on='product_category_name')
+    products = products[['product_id', 'product_category_name_english']].rename(
+        columns={'product_category_name_english': 'category'})
+    facts = profiled_merge(data['order_items'], products, on='product_id')
+    facts = profiled_merge(facts, data['sellers'], on='seller_id')
+    facts = profiled_merge(facts, orders, on='order_id')
+    facts = profiled_merge(facts, reviews, on='order_id', how='left')
+    return facts[DIMENSIONS + MEASURES]
+
+
+def sketch_bins(values):
+    """
+    Returns the (sign, bin) of `values` in the log-scale sketch: bins of |value|
+    grow by GAMMA, so any value of a bin is within RELATIVE_ACCURACY of its representative.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    sign = np.sign(values).astype(np.int8)
+    with np.errstate(divide='ignore'):
+        bins = np.ceil(np.log(np.abs(values)) / np.log(GAMMA))
+    return sign, np.where(sign == 0, 0, bins).astype(np.int32)
+
+
+def sketch_values(sign, bins):
+    """
+    Returns the representative value of the sketch bins.
+    """
+    return sign * 2 * GAMMA ** bins.astype(np.float64) / (GAMMA + 1)
+
+
+class Cube:
+    '''
+    Aggregation cube of the order items over category x seller_state x purchase_month.
+    `cells` holds, per cell and measure, mergeable statistics (count, sum, sum of squares,
+    min, max) and `sketches` the counts of the log-scale quantile sketch of each measure,
+    so any roll-up is a sum of cells and medians come from the merged sketches.
+    '''
+
+    def __init__(self, cells, sketches):
+        self.cells = cells
+        self.sketches = sketches
+
+    @classmethod
+    def build(cls, facts=None):
+        """
+        Builds the cube from `facts` (see get_facts), read from the Olist tables by default.
+        """
+        facts = get_facts() if facts is None else facts
+        grouped = facts.groupby(DIMENSIONS, observed=True)
+        cells = grouped.size().rename('n_items').to_frame()
+        for measure in MEASURES:
+            values = facts[measure]
+            stats = facts[DIMENSIONS].assign(count=values.notna().astype(np.int64), sum=values,
+                                             sum_of_squares=values ** 2, min=values, max=values)
+            stats = stats.groupby(DIMENSIONS, observed=True).agg(
+                {'count': 'sum', 'sum': 'sum', 'sum_of_squares': 'sum', 'min': 'min', 'max': 'max'})
+            cells = cells.join(stats.add_prefix(measure + '_'))
+        sketches = []
+        for measure in MEASURES:
+            values = facts[DIMENSIONS + [measure]].dropna()
+            sign, bins = sketch_bins(values[measure])
+            values = values[DIMENSIONS].assign(measure=measure, sign=sign, bin=bins)
+            sketches.append(values.groupby(DIMENSIONS + ['measure', 'sign', 'bin'], observed=True)
+                            .size().rename('count').reset_index())
+        return cls(cells.reset_index(), pd.concat(sketches, ignore_index=True))
+
+    def merge(self, other):
+        """
+        Returns the cube of the facts of both cubes, e.g. built on two batches of orders.
+        """
+        cells = pd.concat([self.cells, other.cells], ignore_index=True)
+        agg = {column: 'min' if column.endswith('_min') else 'max' if column.endswith('_max') else 'sum'
+               for column in cells.columns if column not in DIMENSIONS}
+        cells = cells.groupby(DIMENSIONS, observed=True, as_index=False).agg(agg)
+        sketches = pd.concat([self.sketches, other.sketches], ignore_index=True)
+        sketches = sketches.groupby(DIMENSIONS + ['measure', 'sign', 'bin'], observed=True,
+                                    as_index=False)['count'].sum()
+        return Cube(cells, sketches)
+
+    def query(self, by, agg='mean', measures=None):
+        """
+        Returns a DataFrame indexed by the dimensions `by` (a list, empty for the grand total)
+        with `agg` (one of AGGS) of each of the `measures` (MEASURES by default).
+        'median' interpolates between the two middle ranks like pandas (see quantile), each rank being
+        read from the sketches within RELATIVE_ACCURACY.
+        """
+        if agg not in AGGS:
+            raise ValueError('agg should be one of %s' % AGGS)
+        measures = MEASURES if measures is None else measures
+        if agg == 'median':
+            return self.quantile(by, 0.5, measures)
+        keys = list(by) or (lambda i: 0)
+        columns = [measure + '_' + stat for measure in measures
+                   for stat in ['count', 'sum', 'sum_of_squares', 'min', 'max']]
+        stats = self.cells.groupby(keys, observed=True)[columns].agg(
+            {column: 'min' if column.endswith('_min') else 'max' if column.endswith('_max') else 'sum'
+             for column in columns})
+        result = pd.DataFrame(index=stats.index)
+        for measure in measures:
+            count = stats[measure + '_count']
+            total = stats[measure + '_sum']
+            if agg == 'count':
+                result[measure] = count
+            elif agg == 'sum':
+                result[measure] = total
+            elif agg == 'mean':
+                result[measure] = total / count.where(count > 0)
+            elif agg in ['var', 'std']:
+                var = (stats[measure + '_sum_of_squares'] - total ** 2 / count.where(count > 0)) / (count - 1).where(count > 1)
+                result[measure] = var.clip(lower=0) ** (0.5 if agg == 'std' else 1)
+            else:
+                result[measure] = stats[measure + '_' + agg]
+        return result
+
+    def quantile(self, by, q, measures=None):
+        """
+        Returns a DataFrame indexed by the dimensions `by` with the
+        `q` quantile of each of the `measures`, from the merged sketches.
+        As pandas, it interpolates between the values of ranks floor(q * (n - 1)) and ceil(q * (n - 1)).
+        """
+        measures = MEASURES if measures is None else measures
+        keys = list(by)
+        sketches = self.sketches[self.sketches['measure'].isin(measures)]
+        sketches = sketches.groupby(keys + ['measure', 'sign', 'bin'], observed=True, as_index=False)['count'].sum()
+        # bins in increasing order of value within each group
+        sketches['order'] = sketches['sign'].astype(np.int64) * sketches['bin']
+        sketches = sketches.sort_values(keys + ['measure', 'sign', 'order'])
+        groups = keys + ['measure']
+        counts = sketches['count'].values
+        cumulated = np.cumsum(counts)
+        starts = np.flatnonzero(sketches.groupby(groups, observed=True, sort=False).ngroup().diff().fillna(1).values)
+        total = np.add.reduceat(counts, starts)
+        rank = q * (total - 1)
+        # the bins holding the values of the ranks around q * (n - 1), found in the cumulated counts of all groups
+        offset = cumulated[starts] - counts[starts]
+        low = np.searchsorted(cumulated, offset + np.floor(rank), side='right')
+        high = np.searchsorted(cumulated, offset + np.ceil(rank), side='right')
+        values = sketch_values(sketches['sign'].values, sketches['bin'].values)
+        result = sketches.iloc[starts][groups]
+        result = result.assign(value=values[low] + (rank - np.floor(rank)) * (values[high] - values[low]))
+        if not keys:
+            return result.set_index('measure')['value'].reindex(measures).to_frame().T.reset_index(drop=True)
+        return result.pivot_table(index=keys, columns='measure', values='value', observed=True)[measures]
+
+    def save(self, path, signature=None):
+        """
+        Persists the cube as parquet files in the folder `path`.
+        """
+        os.makedirs(path, exist_ok=True)
+        for name, df in [('cells', self.cells), ('sketches', self.sketches)]:
+            tmp = os.path.join(path, name + '.parquet.%d.tmp' % os.getpid())
+            df.to_parquet(tmp, engine='pyarrow', index=False)
+            os.replace(tmp, os.path.join(path, name + '.parquet'))
+        tmp = os.path.join(path, 'signature.json.%d.tmp' % os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(signature, f)
+        os.replace(tmp, os.path.join(path, 'signature.json'))
+
+    @classmethod
+    def load(cls, path):
+        return cls(pd.read_parquet(os.path.join(path, 'cells.parquet'), engine='pyarrow'),
+                   pd.read_parquet(os.path.join(path, 'sketches.parquet'), engine='pyarrow'))
+
+
+def get_cube(rebuild=False):
+    """
+    Returns the Cube of the Olist tables, persisted next to the parquet cache (../data/parquet/cube)
+    and built again when one of the csv files changed. Without pyarrow it is built in memory.
+    """
+    cache = Olist().get_store().cache
+    if cache is None:
+        return Cube.build()
+    path = os.path.join(cache.cache_path, 'cube')
+    signature = {file: cache.signature(file) for file in FILES}
+    if not rebuild:
+        try:
+            with open(os.path.join(path, 'signature.json')) as f:
+                if json.load(f) == signature:
+                    return Cube.load(path)
+        except (OSError, ValueError):
+            pass
+    cube = Cube.build()
+    cube.save(path, signature)
+    return cube
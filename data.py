@@ -1,5 +1,94 @@
 import os
+from collections.abc import Mapping
+import numpy as np
 import pandas as pd
+from olist.store import get_store
+from olist.ids import ID_COLUMNS, ID_DICTIONARY, IdRange
+from olist.profiling import profiled, profiled_merge
+
+
+class LazyData(Mapping):
+    '''
+    Read-only dict of the Olist tables returned by `Olist.get_data`.
+    A table is only loaded the first time its key is accessed.
+    When filtering on `series` (ids, or an IdRange), tables without the `series.name` column are
+    reduced to the rows joining the filtered tables, see `Olist.REDUCTIONS`.
+    Id columns hold the codes of `ID_DICTIONARY` when `interned` is True.
+    '''
+
+    def __init__(self, olist, series=None, columns=None, interned=False):
+        self.olist = olist
+        self.series = series
+        self.columns = columns or {}
+        self.interned = interned
+        self.files = dict(zip(olist.keys_names(), olist.FILE_NAMES))
+        self._tables = {}
+        self._reductions = {}
+        self._key_values = {}
+
+    def __getitem__(self, key):
+        if key not in self._tables:
+            if key not in self.files:
+                raise KeyError(key)
+            df = self.olist.load_table(self.files[key], self.columns.get(key),
+                                       *self.reduction(key) or ())
+            self._tables[key] = df if self.interned else ID_DICTIONARY.decode_frame(df)
+        return self._tables[key]
+
+    def reduction(self, key, visiting=()):
+        """
+        Returns the (column, values) pair the rows of `key` are filtered on,
+        or None when the table is read in full.
+        """
+        if self.series is None:
+            return None
+        if key in self._reductions:
+            return self._reductions[key]
+        column = self.series.name
+        result = None
+        if column in self.olist.get_store().get_columns(self.files[key]):
+            if isinstance(self.series, IdRange):
+                result = (column, self.series)
+            else:
+                values = pd.unique(self.series.dropna())
+                if column in ID_COLUMNS:
+                    values = ID_DICTIONARY.encode(column, values)
+                result = (column, values)
+        else:
+            for column, sources in self.olist.REDUCTIONS.get(key, []):
+                values = self.key_values(sources, visiting + (key,))
+                if values is not None:
+                    result = (column, values)
+                    break
+        # a table found unreachable while visiting others may be reachable on its own
+        if result is not None or not visiting:
+            self._reductions[key] = result
+        return result
+
+    def key_values(self, sources, visiting):
+        """
+        Returns the unique values of the (key, column) `sources` once filtered,
+        or None if one of them cannot be reduced.
+        """
+        values = []
+        for source, column in sources:
+            if (source, column) not in self._key_values:
+                reduction = None if source in visiting else self.reduction(source, visiting)
+                if reduction is None:
+                    return None
+                df = self.olist.load_table(self.files[source], [column], *reduction)
+                self._key_values[(source, column)] = pd.unique(df[column].dropna())
+            values.append(self._key_values[(source, column)])
+        return pd.unique(np.concatenate(values)) if len(values) > 1 else values[0]
+
+    def __iter__(self):
+        return iter(self.files)
+
+    def __len__(self):
+        return len(self.files)
+
+    def __repr__(self):
+        return 'LazyData(loaded=%s)' % list(self._tables)
 
 
 class Olist:
@@ -13,26 +102,77 @@ class Olist:
      'olist_order_items_dataset.csv',
      'olist_products_dataset.csv']
 
-    def get_data(self, *args):
+    # when filtering on a column a table does not have, it is reduced to the rows
+    # whose `column` values appear in the already filtered `sources` (key, column),
+    # trying each rule in turn
+    REDUCTIONS = {
+        'orders': [('order_id', [('order_items', 'order_id')]),
+                   ('order_id', [('order_reviews', 'order_id')]),
+                   ('customer_id', [('customers', 'customer_id')])],
+        'order_items': [('order_id', [('orders', 'order_id')])],
+        'order_reviews': [('order_id', [('orders', 'order_id')])],
+        'order_payments': [('order_id', [('orders', 'order_id')])],
+        'customers': [('customer_id', [('orders', 'customer_id')])],
+        'sellers': [('seller_id', [('order_items', 'seller_id')])],
+        'products': [('product_id', [('order_items', 'product_id')])],
+        'geolocation': [('geolocation_zip_code_prefix',
+                         [('customers', 'customer_zip_code_prefix'),
+                          ('sellers', 'seller_zip_code_prefix')])],
+    }
+
+    @profiled
+    def get_data(self, *args, columns=None, interned=False):
         """
         This function returns a Python dict.
         Its keys should be 'sellers', 'orders', 'order_items' etc...
         Its values should be pandas.DataFrame loaded from csv files
+        Tables are loaded lazily, on first access of their key.
+        `columns` optionally maps a key to the list of columns to read for that table,
+        e.g. {'order_items': ['order_id', 'seller_id']}
+        With `interned=True` the id columns hold integer codes,
+        see `olist.ids.ID_DICTIONARY` to translate them.
         """
-        csv_path = os.path.join(__file__[0:-7], '../data/csv')
-        key_names = self.keys_names()
-        data = {}
-        if args:
-            column = args[0].name
-        else:
-            column = ''
-        for (key_name, file) in zip(key_names, self.FILE_NAMES):
-            data[key_name] = pd.read_csv(os.path.join(csv_path, file))
-            if column in data[key_name].columns:
-                data[key_name] = data[key_name][data[key_name][column].isin(list(args[0]))]
-        return data
+        series = args[0] if args else None
+        return LazyData(self, series, columns, interned)
+
+    def load_table(self, file, columns=None, column=None, values=None):
+        """
+        Returns the table `file` restricted to `columns`, keeping only
+        the rows whose `column` is in `values` when given.
+        """
+        store = self.get_store()
+        if column is None:
+            return store.get_table(file, columns)
+        return store.get_filtered(file, columns, column, values)
+
+    def get_store(self):
+        """
+        Returns the process-wide DataStore shared by every Olist instance.
+        Use `Olist().clear_cache()` after the csv files changed on disk.
+        The csv files are read from ../data/csv, or from the OLIST_DATA_DIR folder when set.
+        """
+        csv_path = os.environ.get('OLIST_DATA_DIR') or os.path.join(__file__[0:-7], '../data/csv')
+        return get_store(csv_path)
 
-    def get_matching_table(self, *args):
+    def clear_cache(self):
+        """
+        Forgets every table parsed so far.
+        """
+        self.get_store().invalidate()
+
+    def build_cache(self, force=False):
+        """
+        Converts every csv file into the parquet cache (../data/parquet),
+        skipping the files already up to date unless `force` is True.
+        Same as running `python -m olist.cache`.
+        """
+        cache = self.get_store().cache
+        if cache is None:
+            raise RuntimeError('The columnar cache needs pyarrow')
+        return cache.build_all(self.FILE_NAMES, force=force)
+
+    @profiled
+    def get_matching_table(self, *args, interned=False):
         """
         01-01 > This function returns a matching table between
         columns [ "order_id", "review_id", "customer_id", "product_id", "seller_id"]
@@ -44,17 +184,35 @@ class Olist:
             "product_id",
             "seller_id",
         ]
-        if args:
-            data = self.get_data(args[0])
-        else:
-            data = self.get_data()
-        frames = []
-        for key, df in data.items():
-            match_columns = list(set(columns_matching_table) & set(df.columns))
-            if key in ['orders','order_reviews', 'order_items']:
-                frames.append(data[key][match_columns])
-        merged = frames[0].merge(frames[1], on='order_id', how='outer').merge(frames[2], on='order_id', how='outer')
-        return merged
+        matching_keys = ['orders', 'order_reviews', 'order_items']
+        columns = {}
+        for key, file in zip(self.keys_names(), self.FILE_NAMES):
+            if key in matching_keys:
+                file_columns = self.get_store().get_columns(file)
+                columns[key] = [c for c in columns_matching_table if c in file_columns]
+        data = self.get_data(*args[:1], columns=columns, interned=True)
+        frames = [data[key] for key in matching_keys]
+        merged = profiled_merge(frames[0], frames[1], on='order_id', how='outer')
+        merged = profiled_merge(merged, frames[2], on='order_id', how='outer')
+        return merged if interned else ID_DICTIONARY.decode_frame(merged)
+
+    @profiled
+    def get_zip_centroids(self):
+        """
+        Returns a DataFrame indexed by 'geolocation_zip_code_prefix' with the
+        mean 'geolocation_lat' and 'geolocation_lng' of each zip code prefix.
+        It is computed once and persisted with the parquet cache.
+        """
+        store = self.get_store()
+        file = 'olist_geolocation_dataset.csv'
+
+        def build():
+            geolocation = store.read(file, ['geolocation_zip_code_prefix',
+                                            'geolocation_lat', 'geolocation_lng'])
+            return geolocation.groupby('geolocation_zip_code_prefix', as_index=False).mean()
+
+        centroids = store.get_derived('zip_centroids', file, build)
+        return centroids.set_index('geolocation_zip_code_prefix')
 
     def ping(self):
         """
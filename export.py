@@ -0,0 +1,65 @@
+import os
+import time
+import argparse
+from olist.cache import pyarrow
+from olist.order import Order
+from olist.seller import Seller
+from olist.product import Product
+
+CLASSES = {'order': Order, 'seller': Seller, 'product': Product}
+FORMATS = ['parquet', 'feather', 'csv']
+
+
+def write_frame(df, file, format):
+    if format == 'parquet':
+        df.to_parquet(file, engine='pyarrow', index=False)
+    elif format == 'feather':
+        df.reset_index(drop=True).to_feather(file)
+    else:
+        df.to_csv(file, index=False)
+
+
+def export_training_data(path, classes=None, format=None, executor=None):
+    """
+    Writes the training data of `classes` (names of CLASSES, all by default) in the folder `path`,
+    as order.parquet, seller.parquet and product.parquet. `format` is one of FORMATS,
+    parquet by default (csv without pyarrow). `executor` ('thread' or 'process')
+    computes the features of each training set concurrently.
+    Returns a dict {class name: (file, rows, seconds)}.
+    """
+    format = format or ('parquet' if pyarrow is not None else 'csv')
+    if format not in FORMATS:
+        raise ValueError('format should be one of %s' % FORMATS)
+    if format != 'csv' and pyarrow is None:
+        raise RuntimeError('Writing %s files needs pyarrow' % format)
+    os.makedirs(path, exist_ok=True)
+    written = {}
+    for name in classes or list(CLASSES):
+        start = time.perf_counter()
+        df = CLASSES[name]().get_training_data(executor=executor)
+        file = os.path.join(path, '%s.%s' % (name, format))
+        # write to a temporary file first so readers never see a partial file
+        tmp = file + '.%d.tmp' % os.getpid()
+        write_frame(df, tmp, format)
+        os.replace(tmp, file)
+        written[name] = (file, len(df), time.perf_counter() - start)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write the Olist training sets to columnar files.')
+    parser.add_argument('path', help='folder to write the files to')
+    parser.add_argument('--classes', nargs='+', choices=list(CLASSES), help='training sets to write, all by default')
+    parser.add_argument('--format', choices=FORMATS)
+    parser.add_argument('--executor', choices=['thread', 'process'])
+    parser.add_argument('--data-dir', help='folder of the csv files (sets OLIST_DATA_DIR)')
+    args = parser.parse_args()
+    if args.data_dir:
+        os.environ['OLIST_DATA_DIR'] = args.data_dir
+    for name, (file, rows, seconds) in export_training_data(args.path, args.classes, args.format,
+                                                             args.executor).items():
+        print('%s: %d rows in %s (%.2fs)' % (name, rows, file, seconds))
+
+
+if __name__ == '__main__':
+    main()
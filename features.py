@@ -0,0 +1,75 @@
+import functools
+from olist.profiling import profiled_merge
+
+
+def feature(outputs, inputs=()):
+    """
+    Declares a get_* method as a feature: the columns it `outputs` and the
+    features it reads (method names, 'order.' for the nested Order).
+    `inputs` only document the dependencies: a feature calls them itself, they are
+    not used to resolve features (see resolve_features) but listed by the benchmarks.
+    Results are memoized per instance and arguments, so shared intermediates are computed once.
+    An instance is a snapshot of the tables loaded when it was created: after
+    `Olist().clear_cache()`, create a new instance to compute from the new data.
+    Memoized frames are shared, callers must not modify them in place.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            try:
+                key = (method.__name__, args, tuple(sorted(kwargs.items())))
+                hash(key)
+            except TypeError:
+                return method(self, *args, **kwargs)
+            memo = self.__dict__.setdefault('_features', {})
+            if key not in memo:
+                memo[key] = method(self, *args, **kwargs)
+            return memo[key]
+        wrapper.outputs = list(outputs)
+        wrapper.inputs = list(inputs)
+        return wrapper
+    return decorator
+
+
+def get_registry(obj):
+    """
+    Returns a dict {method name: (outputs, inputs)} of the features of `obj`.
+    """
+    registry = {}
+    for name in dir(type(obj)):
+        method = getattr(type(obj), name)
+        if callable(method) and hasattr(method, 'outputs'):
+            registry[name] = (method.outputs, method.inputs)
+    return registry
+
+
+def resolve_features(obj, columns):
+    """
+    Returns the names of the features computing `columns`, in declaration order,
+    from their declared outputs only (each feature computes its inputs itself).
+    Raises a KeyError for a column no feature outputs.
+    """
+    registry = get_registry(obj)
+    order = [name for name in type(obj).__dict__ if name in registry]
+    names = []
+    for column in columns:
+        providers = [name for name in order if column in registry[name][0]]
+        if not providers:
+            raise KeyError('No feature of %s outputs %r' % (type(obj).__name__, column))
+        if providers[0] not in names:
+            names.append(providers[0])
+    return [name for name in order if name in names]
+
+
+def build_features(obj, columns, on):
+    """
+    Returns a DataFrame with the `on` column and the requested `columns`,
+    only computing the features providing them, inner-merged on `on`.
+    """
+    frames = [getattr(obj, name)() for name in resolve_features(obj, columns)]
+    merged = frames[0]
+    for frame in frames[1:]:
+        merged = profiled_merge(merged, frame, on=on, how='inner')
+    if on not in merged.columns:
+        merged = merged.reset_index()
+    return merged[[on] + list(columns)]
@@ -0,0 +1,198 @@
+import functools
+import threading
+import contextlib
+import numpy as np
+import pandas as pd
+from olist.profiling import profiled
+
+ID_COLUMNS = ['order_id', 'customer_id', 'product_id', 'seller_id', 'review_id']
+
+
+class IdDictionary:
+    '''
+    Maps the 32-char hex ids of each id column to compact integer codes.
+    The dictionary only grows, so a code stays valid for the whole process
+    and every table encoded with it can be joined on codes.
+    '''
+
+    def __init__(self):
+        self._ids = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        return {'ids': dict(self._ids)}
+
+    def __setstate__(self, state):
+        self._ids = state['ids']
+        self._lock = threading.Lock()
+
+    def encode(self, column, values):
+        """
+        Returns the int32 codes of the ids `values`, adding the unknown ones.
+        Missing ids are encoded as NaN (the codes are then float64).
+        """
+        values = pd.Series(values, copy=False)
+        with self._lock:
+            index = self._ids.get(column, pd.Index([], dtype=object))
+            codes = index.get_indexer(values)
+            new = (codes == -1) & values.notna().values
+            if new.any():
+                # codes follow the order ids are first seen in, grouping on codes does not sort
+                # by id: see the `sort` argument of decode_ids
+                index = index.append(pd.Index(np.sort(pd.unique(values[new])), dtype=object))
+                self._ids[column] = index
+                codes[new] = index.get_indexer(values[new])
+        if (codes == -1).any():
+            return np.where(codes == -1, np.nan, codes)
+        return codes.astype(np.int32)
+
+    @contextlib.contextmanager
+    def scope(self):
+        """
+        Context manager forgetting on exit the ids added while it ran, so a loop over chunks
+        does not grow the dictionary. Codes of the ids known before stay valid, the codes
+        of the new ids must not be used after it.
+        """
+        with self._lock:
+            ids = dict(self._ids)
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._ids = ids
+
+    def decode(self, column, codes):
+        """
+        Returns the ids of the integer `codes` as an object array.
+        """
+        codes = np.asarray(codes)
+        ids = self._ids.get(column, pd.Index([], dtype=object)).values
+        if codes.dtype.kind == 'f':
+            decoded = np.full(len(codes), np.nan, dtype=object)
+            mask = ~np.isnan(codes)
+            decoded[mask] = ids[codes[mask].astype(np.int64)]
+            return decoded
+        return ids[codes]
+
+    def encode_frame(self, df):
+        """
+        Returns `df` with its id columns (and index) replaced by their codes.
+        """
+        if df.index.name in ID_COLUMNS and df.index.dtype.kind not in 'if':
+            df = df.set_axis(pd.Index(self.encode(df.index.name, df.index), name=df.index.name), axis=0)
+        columns = [c for c in ID_COLUMNS if c in df.columns]
+        if not columns or all(df[c].dtype.kind in 'if' for c in columns):
+            return df
+        return df.assign(**{c: self.encode(c, df[c]) for c in columns if df[c].dtype.kind not in 'if'})
+
+    def decode_frame(self, df):
+        """
+        Returns `df` with the codes of its id columns (and index) translated back to ids.
+        """
+        if not isinstance(df, pd.DataFrame):
+            return df
+        columns = [c for c in ID_COLUMNS if c in df.columns and df[c].dtype.kind in 'if']
+        if columns:
+            df = df.assign(**{c: self.decode(c, df[c].values) for c in columns})
+        if df.index.name in ID_COLUMNS and df.index.dtype.kind in 'if':
+            df = df.set_axis(pd.Index(self.decode(df.index.name, df.index.values),
+                                      name=df.index.name), axis=0)
+        return df
+
+
+ID_DICTIONARY = IdDictionary()
+
+
+class IdRange:
+    '''
+    Row filter keeping the rows whose `name` column is in [low, high), compared as id strings,
+    unbounded where `low` or `high` is None. Used as the filter of `Olist.get_data`
+    in place of a Series of ids, it is read as a range of the parquet copy sorted on `name`.
+    '''
+
+    def __init__(self, name, low=None, high=None):
+        self.name = name
+        self.low = low
+        self.high = high
+
+    def contains(self, values):
+        """
+        Returns a boolean array, True for the id strings of `values` in the range.
+        """
+        values = pd.Series(values, copy=False)
+        mask = np.ones(len(values), dtype=bool)
+        if self.low is not None:
+            mask &= (values >= self.low).values
+        if self.high is not None:
+            mask &= (values < self.high).values
+        return mask
+
+    def filters(self):
+        """
+        Returns the range as pyarrow filters.
+        """
+        return ([] if self.low is None else [(self.name, '>=', self.low)]) + \
+            ([] if self.high is None else [(self.name, '<', self.high)])
+
+    def __repr__(self):
+        return 'IdRange(%r, %r, %r)' % (self.name, self.low, self.high)
+
+_calls = threading.local()
+
+
+def sort_ids(df, keys):
+    """
+    Returns `df` sorted by the decoded id columns (or index) `keys`, as grouping on the ids would.
+    Codes depend on what the process interned before, so a frame grouped on codes is not sorted by id.
+    An ascending index stays ascending, as the one of a grouped frame.
+    """
+    if not isinstance(df, pd.DataFrame):
+        return df
+    keys = [keys] if isinstance(keys, str) else list(keys)
+    if keys == [df.index.name]:
+        return df if df.index.is_monotonic_increasing else df.sort_index(kind='stable')
+    if len(keys) == 1 and df[keys[0]].is_monotonic_increasing:
+        return df
+    ordered = df.sort_values(keys, kind='stable')
+    if df.index.is_monotonic_increasing:
+        ordered = ordered.set_axis(df.index, axis=0)
+    return ordered
+
+
+def decode_ids(method=None, sort=None):
+    """
+    Decorator for the public methods of Order, Seller and Product.
+    They compute on interned ids, translated back to strings
+    only when the outermost decorated call returns.
+    Methods grouping on an id pass the id column(s) as `sort`: their rows are then
+    sorted by the decoded ids, whatever the codes, e.g. `@decode_ids(sort='order_id')`.
+    """
+    if method is None:
+        return functools.partial(decode_ids, sort=sort)
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        depth = getattr(_calls, 'depth', 0)
+        _calls.depth = depth + 1
+        try:
+            result = method(*args, **kwargs)
+        finally:
+            _calls.depth = depth
+        if depth == 0:
+            result = ID_DICTIONARY.decode_frame(result)
+            return result if sort is None else sort_ids(result, sort)
+        return result
+    return profiled(wrapper)
+
+
+def call_interned(function, *args, **kwargs):
+    """
+    Calls `function` as if from inside a decorated method, so a decorated
+    method keeps interned ids in its result (e.g. when run by a worker thread).
+    """
+    depth = getattr(_calls, 'depth', 0)
+    _calls.depth = depth + 1
+    try:
+        return function(*args, **kwargs)
+    finally:
+        _calls.depth = depth
@@ -0,0 +1,355 @@
+import os
+import abc
+import numpy as np
+import pandas as pd
+from olist.data import Olist
+from olist.ids import ID_DICTIONARY
+from olist.schema import apply_schema
+from olist.kernels import star_indicator, review_cost, positive_part
+
+BATCH_KEYS = ['orders', 'order_items', 'order_reviews']
+NO_DATE = np.iinfo(np.int64).max
+# per order state: what the aggregates of its items depend on
+STATS = {'delivered': bool, 'order_approved_at': 'datetime64[ns]', 'order_delivered_carrier_date': 'datetime64[ns]',
+         'wait_time': np.float64, 'n_reviews': np.int64, 'five_stars': np.int64, 'one_stars': np.int64,
+         'score': np.int64, 'cost': np.int64, 'n_items': np.int64, 'delay': np.float64}
+COUNTS = ['n_reviews', 'five_stars', 'one_stars', 'score', 'cost', 'n_items', 'delay']
+
+
+def prepare_batch(batch):
+    """
+    Returns the 'orders', 'order_items' and 'order_reviews' tables of `batch`
+    (a dict like the one of `Olist.get_data`) typed and with interned ids.
+    """
+    olist = Olist()
+    files = dict(zip(olist.keys_names(), olist.FILE_NAMES))
+    return {key: ID_DICTIONARY.encode_frame(apply_schema(files[key], batch[key]))
+            for key in BATCH_KEYS}
+
+
+def get_order_stats(orders):
+    """
+    Returns a DataFrame indexed by order_id with the STATS of `orders`:
+    whether it is delivered, its approval and carrier dates, its wait time,
+    and no reviews nor items yet.
+    """
+    wait_time = (orders['order_delivered_customer_date'] - orders['order_purchase_timestamp']) / np.timedelta64(24, 'h')
+    stats = pd.DataFrame({'delivered': (orders['order_status'] == 'delivered').values,
+                          'order_approved_at': orders['order_approved_at'].values,
+                          'order_delivered_carrier_date': orders['order_delivered_carrier_date'].values,
+                          'wait_time': wait_time.values},
+                         index=pd.Index(orders['order_id'].values, name='order_id'))
+    return stats.assign(**{name: np.zeros(len(stats), dtype=STATS[name]) for name in COUNTS})
+
+
+def get_order_counts(order_items, order_reviews, carrier):
+    """
+    Returns a DataFrame indexed by order_id with, for each order of `order_items` or `order_reviews`:
+    its number of reviews and their sums of five stars, one stars, scores and costs,
+    its number of items and their summed delay to the `carrier` date of their order.
+    """
+    reviews = pd.DataFrame({'order_id': order_reviews['order_id'],
+                            'n_reviews': 1,
+                            'five_stars': star_indicator(order_reviews['review_score'], 5),
+                            'one_stars': star_indicator(order_reviews['review_score'], 1),
+                            'score': order_reviews['review_score'].astype(np.int64),
+                            'cost': review_cost(order_reviews['review_score'])})
+    delay = (order_items['order_id'].map(carrier) - order_items['shipping_limit_date']) / np.timedelta64(24, 'h')
+    items = pd.DataFrame({'order_id': order_items['order_id'],
+                          'n_items': 1,
+                          'delay': positive_part(delay)})
+    counts = pd.concat([reviews.groupby('order_id').sum(), items.groupby('order_id').sum()], axis=1)
+    return counts.reindex(columns=COUNTS).fillna(0)
+
+
+def join_order_stats(pairs, stats):
+    return pairs.join(stats, on='order_id')
+
+
+class Aggregates(abc.ABC):
+    '''
+    Mergeable aggregate state, one value per interned id of `key` for each field,
+    held in NumPy arrays indexed by the id codes, with the per order state it is computed from:
+    the order `stats` and the (order, key) `pairs` with their number of items.
+    A batch only touches the codes and orders it holds: the contributions of the orders
+    getting late items or reviews are removed with their previous state and added back with the new one.
+    '''
+    key = None
+    FIELDS = {}
+    FILLS = {}
+
+    def __init__(self):
+        self.arrays = {name: np.zeros(0, dtype=dtype) for name, dtype in self.FIELDS.items()}
+        self.stats = pd.DataFrame({name: np.zeros(0, dtype=dtype) for name, dtype in STATS.items()},
+                                  index=pd.Index(np.zeros(0, dtype=np.int32), name='order_id'))
+        self.pairs = pd.DataFrame({'order_id': np.zeros(0, dtype=np.int32), self.key: np.zeros(0, dtype=np.int32),
+                                   'n': np.zeros(0, dtype=np.int64)})
+
+    @staticmethod
+    def grow(array, size, fill):
+        if len(array) >= size:
+            return array
+        grown = np.full(max(size, 2 * len(array)), fill, dtype=array.dtype)
+        grown[:len(array)] = array
+        return grown
+
+    def add(self, codes, **values):
+        codes = np.asarray(codes, dtype=np.int64)
+        for name, value in values.items():
+            self.arrays[name] = self.grow(self.arrays[name], codes.max() + 1 if len(codes) else 0, 0)
+            np.add.at(self.arrays[name], codes, np.asarray(value))
+
+    def check_new_orders(self, orders):
+        """
+        Raises a ValueError if `orders` holds orders of a previous batch.
+        """
+        if orders['order_id'].isin(self.stats.index).any() or orders['order_id'].duplicated().any():
+            raise ValueError('The batch holds orders already ingested, an order cannot be updated by a later batch')
+
+    def update(self, batch):
+        """
+        Ingests `batch`, a dict of 'orders', 'order_items' and 'order_reviews', and updates the aggregates.
+        Its items and reviews may belong to its new orders or to orders of earlier batches.
+        """
+        batch = prepare_batch(batch)
+        self.check_new_orders(batch['orders'])
+        stats = pd.concat([self.stats, get_order_stats(batch['orders'])])
+        counts = get_order_counts(batch['order_items'], batch['order_reviews'],
+                                  stats['order_delivered_carrier_date'])
+        unknown = counts.index.difference(stats.index)
+        if len(unknown):
+            raise ValueError('The batch holds items or reviews of %d orders never ingested, '
+                             'an order must come before or with them' % len(unknown))
+        for name in COUNTS:
+            stats.loc[counts.index, name] += counts[name].values.astype(STATS[name])
+        late = self.pairs['order_id'].isin(counts.index).values
+        previous = self.pairs[late]
+        items = batch['order_items'].groupby(['order_id', self.key], sort=False).size().rename('n').reset_index()
+        touched = pd.concat([previous, items]).groupby(['order_id', self.key], sort=False)['n'].sum().reset_index()
+        self.ingest(join_order_stats(previous, self.stats), -1)
+        self.ingest(join_order_stats(touched, stats), 1)
+        self.add_items(batch['order_items'])
+        self.stats = stats
+        self.pairs = pd.concat([self.pairs[~late], touched], ignore_index=True)
+        return self
+
+    @abc.abstractmethod
+    def ingest(self, pairs, sign):
+        """
+        Adds (`sign` 1) or removes (`sign` -1) the contributions of the (order, key) `pairs`
+        joined with the stats of their orders.
+        """
+
+    @abc.abstractmethod
+    def add_items(self, items):
+        """
+        Adds the contributions of each item, independent of the other items and reviews of its order.
+        """
+
+    def frame(self, mask, **columns):
+        """
+        Returns a DataFrame with the decoded ids where `mask` holds and `columns`.
+        """
+        codes = np.nonzero(mask)[0]
+        df = pd.DataFrame({self.key: ID_DICTIONARY.decode(self.key, codes)})
+        for name, values in columns.items():
+            df[name] = values[codes]
+        return df
+
+    def field(self, name, size):
+        return self.grow(self.arrays[name], size, self.FILLS.get(name, 0))[:size]
+
+    def save(self, path):
+        """
+        Persists the aggregates and the per order state as parquet files in the folder `path`,
+        keyed by the ids (codes are only valid in the process that made them).
+        """
+        os.makedirs(path, exist_ok=True)
+        n_orders = self.arrays['n_orders']
+        arrays = self.frame(n_orders > 0, **{name: self.field(name, len(n_orders)) for name in self.arrays})
+        tables = [('arrays', arrays), ('stats', ID_DICTIONARY.decode_frame(self.stats).reset_index()),
+                  ('pairs', ID_DICTIONARY.decode_frame(self.pairs))]
+        for name, df in tables:
+            tmp = os.path.join(path, name + '.parquet.%d.tmp' % os.getpid())
+            df.to_parquet(tmp, engine='pyarrow', index=False)
+            os.replace(tmp, os.path.join(path, name + '.parquet'))
+
+    @classmethod
+    def load(cls, path):
+        """
+        Returns the aggregates saved in the folder `path`, with the ids interned in this process.
+        """
+        aggregates = cls()
+        arrays, stats, pairs = [ID_DICTIONARY.encode_frame(pd.read_parquet(os.path.join(path, name + '.parquet'),
+                                                                           engine='pyarrow'))
+                                for name in ['arrays', 'stats', 'pairs']]
+        codes = arrays[cls.key].values.astype(np.int64)
+        for name, array in aggregates.arrays.items():
+            aggregates.arrays[name] = np.full(codes.max(initial=-1) + 1, cls.FILLS.get(name, 0), dtype=array.dtype)
+            aggregates.arrays[name][codes] = arrays[name].values
+        aggregates.stats = stats.set_index('order_id').astype(STATS)
+        aggregates.pairs = pairs
+        return aggregates
+
+
+class SellerAggregates(Aggregates):
+    '''
+    Incremental version of Seller.get_quantity, get_sales, get_review_score,
+    get_active_dates and get_seller_delay_wait_time, equal to a full recompute.
+    An order comes once, in the batch holding it or before its items and reviews,
+    which may come in later batches.
+    Means are kept as sum and count, weighted like the rows of the matching table.
+    '''
+    key = 'seller_id'
+    FIELDS = {'n_orders': np.int64, 'quantity': np.int64, 'sales': np.float64,
+              'review_weight': np.int64, 'five_stars': np.int64, 'one_stars': np.int64,
+              'score': np.int64, 'costs': np.int64,
+              'delay_weight': np.int64, 'wait_time': np.float64, 'delay_to_carrier': np.float64,
+              'date_first_sale': np.int64, 'date_last_sale': np.int64}
+    # dates are kept as int64 nanoseconds
+    FILLS = {'date_first_sale': NO_DATE, 'date_last_sale': -NO_DATE}
+
+    def add_items(self, items):
+        self.add(items['seller_id'], sales=items['price'])
+
+    def ingest(self, pairs, sign):
+        codes = pairs['seller_id'].values
+        n = pairs['n'].values
+        # rows of the matching table: one per item and review of the order
+        reviewed = pairs['n_reviews'].values.astype(np.int64)
+        rows = n * np.maximum(reviewed, 1)
+        self.add(codes, n_orders=np.full(len(pairs), sign, dtype=np.int64), quantity=sign * rows,
+                 review_weight=sign * rows * reviewed,
+                 five_stars=sign * rows * pairs['five_stars'].values,
+                 one_stars=sign * rows * pairs['one_stars'].values,
+                 score=sign * rows * pairs['score'].values,
+                 costs=sign * rows * pairs['cost'].values)
+        # rows of the delay table: one per row of the matching table and item of the order
+        delivered = (pairs['delivered'] & pairs['wait_time'].notna()).values
+        delay_rows = sign * rows[delivered] * pairs['n_items'].values[delivered]
+        self.add(codes[delivered], delay_weight=delay_rows,
+                 wait_time=delay_rows * pairs['wait_time'].values[delivered],
+                 delay_to_carrier=sign * rows[delivered] * pairs['delay'].values[delivered])
+        if sign < 0:
+            # the approval date of an order does not change, so its minimum and maximum stay
+            return
+        approved = pairs['order_approved_at'].notna().values
+        dates = pairs['order_approved_at'].values.astype('datetime64[ns]').astype(np.int64)
+        size = len(self.arrays['n_orders'])
+        for name, ufunc in [('date_first_sale', np.minimum), ('date_last_sale', np.maximum)]:
+            self.arrays[name] = self.field(name, size)
+            ufunc.at(self.arrays[name], codes[approved], dates[approved])
+
+    def get_quantity(self):
+        """
+        Returns a DataFrame with:
+        'seller_id', 'n_orders', 'quantity', 'quantity_per_order'
+        """
+        n_orders = self.arrays['n_orders']
+        quantity = self.field('quantity', len(n_orders))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            per_order = quantity / n_orders
+        return self.frame(n_orders > 0, n_orders=n_orders, quantity=quantity,
+                          quantity_per_order=per_order)
+
+    def get_sales(self):
+        """
+        Returns a DataFrame with:
+        'seller_id', 'sales'
+        """
+        n_orders = self.arrays['n_orders']
+        return self.frame(n_orders > 0, sales=self.field('sales', len(n_orders)))
+
+    def get_review_score(self):
+        """
+        Returns a DataFrame with:
+        'seller_id', 'share_of_five_stars', 'share_of_one_stars',
+        'review_score', 'costs'
+        """
+        size = len(self.arrays['n_orders'])
+        weight = self.field('review_weight', size)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.frame(weight > 0,
+                              share_of_five_stars=self.field('five_stars', size) / weight,
+                              share_of_one_stars=self.field('one_stars', size) / weight,
+                              review_score=self.field('score', size) / weight,
+                              costs=self.field('costs', size))
+
+    def get_active_dates(self):
+        """
+        Returns a DataFrame with:
+        'seller_id', 'date_first_sale', 'date_last_sale'
+        """
+        n_orders = self.arrays['n_orders']
+        dates = {}
+        for name, fill in self.FILLS.items():
+            values = self.field(name, len(n_orders))
+            dates[name] = np.where(values == fill, np.datetime64('NaT'),
+                                   values.astype('datetime64[ns]')).astype('datetime64[ns]')
+        return self.frame(n_orders > 0, **dates)
+
+    def get_seller_delay_wait_time(self):
+        """
+        Returns a DataFrame with:
+        'seller_id', 'wait_time', 'delay_to_carrier'
+        """
+        size = len(self.arrays['n_orders'])
+        weight = self.field('delay_weight', size)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.frame(weight > 0,
+                              wait_time=self.field('wait_time', size) / weight,
+                              delay_to_carrier=self.field('delay_to_carrier', size) / weight)
+
+
+class ProductAggregates(Aggregates):
+    '''
+    Incremental version of Product.get_quantity, get_sales and get_review_score,
+    equal to a full recompute. Batches follow the rules of SellerAggregates.
+    '''
+    key = 'product_id'
+    FIELDS = {'n_orders': np.int64, 'quantity': np.int64, 'sales': np.float64,
+              'n_reviews': np.int64, 'five_stars': np.int64, 'one_stars': np.int64,
+              'score': np.int64, 'cost': np.int64}
+
+    def add_items(self, items):
+        self.add(items['product_id'], quantity=np.ones(len(items), dtype=np.int64),
+                 sales=items['price'])
+
+    def ingest(self, pairs, sign):
+        self.add(pairs['product_id'], n_orders=np.full(len(pairs), sign, dtype=np.int64),
+                 n_reviews=sign * pairs['n_reviews'].values,
+                 five_stars=sign * pairs['five_stars'].values,
+                 one_stars=sign * pairs['one_stars'].values,
+                 score=sign * pairs['score'].values,
+                 cost=sign * pairs['cost'].values)
+
+    def get_quantity(self):
+        """
+        Returns a DataFrame with:
+        'product_id', 'n_orders', 'quantity'
+        """
+        n_orders = self.arrays['n_orders']
+        return self.frame(n_orders > 0, n_orders=n_orders,
+                          quantity=self.field('quantity', len(n_orders)))
+
+    def get_sales(self):
+        """
+        Returns a DataFrame indexed by 'product_id' with: 'sales'
+        """
+        n_orders = self.arrays['n_orders']
+        return self.frame(n_orders > 0, sales=self.field('sales', len(n_orders))).set_index('product_id')
+
+    def get_review_score(self):
+        """
+        Returns a DataFrame with:
+        'product_id', 'share_of_one_stars', 'share_of_five_stars',
+        'review_score', 'cost'
+        """
+        size = len(self.arrays['n_orders'])
+        n_reviews = self.field('n_reviews', size)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.frame(n_reviews > 0,
+                              share_of_one_stars=self.field('one_stars', size) / n_reviews,
+                              share_of_five_stars=self.field('five_stars', size) / n_reviews,
+                              review_score=self.field('score', size) / n_reviews,
+                              cost=self.field('cost', size))
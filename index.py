@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+
+
+class OrderIndex:
+    '''
+    Normalized index of the orders with their items and reviews, held in NumPy arrays.
+    Orders are numbered by their position in `order_ids` (sorted id codes). The items of
+    the i-th order are the rows `item_rows[item_offsets[i]:item_offsets[i + 1]]` of the
+    order_items table, and the same goes for reviews (CSR layout).
+    `item_sellers` and `item_products` hold the seller and product codes of these items.
+    The rows of `Olist.get_matching_table` are the items times the reviews of each order:
+    aggregations weight the orders by these counts instead of building the cross product.
+    '''
+
+    def __init__(self, orders, order_items, order_reviews):
+        self.order_ids = np.unique(np.concatenate([orders['order_id'].values,
+                                                   order_items['order_id'].values,
+                                                   order_reviews['order_id'].values]).astype(np.int64))
+        self.orders = self.positions(orders['order_id'])
+        self.has_order = np.zeros(len(self), dtype=bool)
+        self.has_order[self.orders] = True
+        item_orders = self.positions(order_items['order_id'])
+        self.item_rows, self.item_offsets = self.csr(item_orders)
+        review_orders = self.positions(order_reviews['order_id'])
+        self.review_rows, self.review_offsets = self.csr(review_orders)
+        self.n_items = np.diff(self.item_offsets)
+        self.n_reviews = np.diff(self.review_offsets)
+        self.item_orders = item_orders[self.item_rows]
+        self.item_sellers = self.item_column(order_items, 'seller_id')
+        self.item_products = self.item_column(order_items, 'product_id')
+
+    def __len__(self):
+        return len(self.order_ids)
+
+    def positions(self, order_ids):
+        """
+        Returns the positions of `order_ids` (codes) in the index.
+        """
+        return np.searchsorted(self.order_ids, np.asarray(order_ids, dtype=np.int64))
+
+    def csr(self, positions):
+        """
+        Returns the rows sorted by order and the offsets of each order in them.
+        """
+        rows = np.argsort(positions, kind='stable')
+        counts = np.bincount(positions, minlength=len(self))
+        return rows, np.concatenate([[0], np.cumsum(counts)])
+
+    def item_column(self, order_items, column):
+        if column not in order_items.columns:
+            return None
+        return order_items[column].values[self.item_rows]
+
+    def order_sums(self, order_ids, values):
+        """
+        Returns the sum of `values` for each order, `order_ids` giving the order of each value.
+        """
+        return np.bincount(self.positions(order_ids), weights=np.asarray(values, dtype=np.float64),
+                           minlength=len(self))
+
+    def order_values(self, values):
+        """
+        Returns the `values` of the rows of the orders table for each order,
+        missing for the orders absent from it.
+        """
+        return pd.Series(np.asarray(values), index=self.orders).reindex(np.arange(len(self))).values
+
+    def pairs(self, keys, **values):
+        """
+        Returns a DataFrame with one row per order and key, `keys` being `item_sellers`
+        or `item_products`, with the order 'position', the 'key' and its number of items 'n'.
+        `values`, columns of the order_items table, are summed over these items.
+        """
+        keys = pd.Series(keys)
+        valid = keys.notna().values
+        df = pd.DataFrame({'position': self.item_orders[valid], 'key': keys.values[valid]})
+        for name, column in values.items():
+            df[name] = np.asarray(column)[self.item_rows][valid]
+        grouped = df.groupby(['position', 'key'], sort=False)
+        pairs = grouped.size().rename('n').to_frame()
+        if values:
+            pairs = pairs.join(grouped[list(values)].sum())
+        return pairs.reset_index()
+
+    def weights(self, positions):
+        """
+        Returns the number of rows of the matching table per item of the orders at `positions`:
+        one per review, one when the order has no review.
+        """
+        return np.maximum(self.n_reviews[positions], 1)
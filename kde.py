@@ -0,0 +1,92 @@
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+GRID_SIZE = 1024
+# number of bandwidths the densities extend beyond the data, as seaborn's `cut`
+CUT = 3
+CACHE_SIZE = 32
+_DENSITIES = OrderedDict()
+
+
+def stratified_sample(codes, max_samples, seed=0):
+    """
+    Returns a boolean mask keeping at most `max_samples` random rows of each group of `codes`.
+    """
+    rng = np.random.default_rng(seed)
+    shuffled = rng.permutation(len(codes))
+    order = shuffled[np.argsort(codes[shuffled], kind='stable')]
+    starts = np.searchsorted(codes[order], codes[order], side='left')
+    keep = np.zeros(len(codes), dtype=bool)
+    keep[order[np.arange(len(order)) - starts < max_samples]] = True
+    return keep
+
+
+def binned_kde(codes, values, n_groups, grid_size=GRID_SIZE):
+    """
+    Returns the (n_groups, grid_size) grids and Gaussian kernel densities of `values`
+    for each group of `codes`, with Scott's bandwidth as seaborn's kdeplot.
+    The grid of each group spans its values and CUT bandwidths beyond, so narrow groups keep
+    `grid_size` points next to wide ones. Values are linearly binned on their group's grid and
+    every group is smoothed at once with FFTs. Densities of groups with no spread are missing.
+    """
+    counts = np.bincount(codes, minlength=n_groups).astype(float)
+    sums = np.bincount(codes, weights=values, minlength=n_groups)
+    squares = np.bincount(codes, weights=values ** 2, minlength=n_groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        std = np.sqrt(np.maximum(squares - sums ** 2 / counts, 0) / (counts - 1))
+        bandwidth = std * counts ** (-1 / 5)
+    low = pd.Series(values).groupby(codes).min().reindex(range(n_groups)).values
+    high = pd.Series(values).groupby(codes).max().reindex(range(n_groups)).values
+    valid = bandwidth > 0
+    start = np.where(valid, low - CUT * bandwidth, 0)
+    step = np.where(valid, (high - low + 2 * CUT * bandwidth) / (grid_size - 1), 1)
+    grid = start[:, None] + step[:, None] * np.arange(grid_size)[None, :]
+
+    # linear binning: each value is split between the two nearest points of its group's grid
+    position = (values - start[codes]) / step[codes]
+    left = np.clip(np.floor(position).astype(np.int64), 0, grid_size - 2)
+    fraction = position - left
+    binned = np.bincount(codes * grid_size + left, weights=1 - fraction, minlength=n_groups * grid_size)
+    binned += np.bincount(codes * grid_size + left + 1, weights=fraction, minlength=n_groups * grid_size)
+    binned = binned.reshape(n_groups, grid_size)
+
+    # the Fourier transform of a Gaussian kernel is known, zero padding avoids wrapping around;
+    # bandwidths are in grid steps of their group
+    size = 2 * grid_size
+    frequencies = np.fft.rfftfreq(size)
+    widths = np.where(valid, bandwidth / step, 0)
+    kernels = np.exp(-0.5 * (2 * np.pi * frequencies[None, :] * widths[:, None]) ** 2)
+    smoothed = np.fft.irfft(np.fft.rfft(binned, n=size, axis=1) * kernels, n=size, axis=1)[:, :grid_size]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        densities = np.maximum(smoothed, 0) / (counts * step)[:, None]
+    densities[~valid] = np.nan
+    return grid, densities
+
+
+def get_densities(df, variable, dimension, max_samples=None, grid_size=GRID_SIZE, seed=0):
+    """
+    Returns a DataFrame with the kernel density of `variable` for each value of `dimension`:
+    `dimension`, `variable` (the grid) and 'density', computed for all of them in one pass.
+    `max_samples` keeps at most that many random rows per value of `dimension`.
+    Results are cached, computing the same densities again is a lookup.
+    """
+    data = df[[variable, dimension]].dropna()
+    key = (variable, dimension, max_samples, grid_size, seed, len(data),
+           int(pd.util.hash_pandas_object(data, index=False).sum()))
+    if key in _DENSITIES:
+        _DENSITIES.move_to_end(key)
+        return _DENSITIES[key]
+    codes, levels = pd.factorize(data[dimension], sort=True)
+    values = data[variable].values.astype(float)
+    if max_samples is not None:
+        keep = stratified_sample(codes, max_samples, seed)
+        codes, values = codes[keep], values[keep]
+    grid, densities = binned_kde(codes, values, len(levels), grid_size)
+    result = pd.DataFrame({dimension: np.repeat(np.asarray(levels), grid_size),
+                           variable: grid.ravel(),
+                           'density': densities.ravel()}).dropna()
+    _DENSITIES[key] = result
+    if len(_DENSITIES) > CACHE_SIZE:
+        _DENSITIES.popitem(last=False)
+    return result
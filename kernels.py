@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+
+# cost (in BRL) of a review, by review score; other scores cost nothing
+REVIEW_COSTS = {1: 100, 2: 50, 3: 40}
+
+
+def star_indicator(scores, star):
+    """
+    Returns 1 where `scores` equals `star`, 0 elsewhere (missing scores included).
+    """
+    return (scores == star).astype(np.int64)
+
+
+def review_cost(scores):
+    """
+    Returns the cost of each review score, looked up in REVIEW_COSTS.
+    """
+    costs = np.select([scores == score for score in REVIEW_COSTS],
+                      list(REVIEW_COSTS.values()), 0)
+    return pd.Series(costs, index=scores.index)
+
+
+def positive_part(values):
+    """
+    Returns `values` where positive, 0 elsewhere (missing values included).
+    """
+    return values.where(values > 0, 0)
+
+
+def days_late(delay, actual, expected):
+    """
+    Returns the `delay` (in days) of `actual` vs `expected` dates, set to 0
+    when `actual` came first. Missing dates keep a missing delay.
+    """
+    return delay.mask(actual < expected, 0)
@@ -1,8 +1,10 @@
-import os
-import pandas as pd
-import numpy as np
 from olist.utils import haversine_distance
 from olist.data import Olist
+from olist.ids import decode_ids
+from olist.features import feature, build_features
+from olist.kernels import star_indicator, days_late
+from olist.parallel import run_features, merge_tree
+from olist.profiling import profiled_merge
 
 
 class Order:
@@ -10,17 +12,25 @@ class Order:
     DataFrames containing all orders as index,
     and various properties of these orders as columns
     '''
+    # columns read by the methods below, for the tables they use
+    COLUMNS = {
+        'order_reviews': ['order_id', 'review_score'],
+        'order_items': ['order_id', 'order_item_id', 'seller_id', 'price', 'freight_value'],
+        'customers': ['customer_id', 'customer_zip_code_prefix'],
+        'sellers': ['seller_id', 'seller_zip_code_prefix'],
+    }
 
     def __init__(self, *args):
         # Assign an attribute ".data" to all new instances of Order
+        # ids are interned to integer codes, public methods return them as strings
         olist = Olist()
         if args:
-            self.data = olist.get_data(args[0])
-            self.matching_table = olist.get_matching_table(args[0])
+            self.data = olist.get_data(args[0], columns=self.COLUMNS, interned=True)
         else:
-            self.data = Olist().get_data()
-            self.matching_table = Olist().get_matching_table()
+            self.data = olist.get_data(columns=self.COLUMNS, interned=True)
 
+    @decode_ids
+    @feature(['wait_time', 'expected_wait_time', 'delay_vs_expected', 'order_status', 'order_purchase_timestamp'])
     def get_wait_time(self, is_delivered=True):
         """
         02-01 > Returns a DataFrame with:
@@ -31,44 +41,33 @@ class Order:
 
         if is_delivered == True:
             orders = orders[orders['order_status'] == 'delivered']
-        # handle datetime
-        colum = ['order_purchase_timestamp',
-               'order_approved_at', 'order_delivered_carrier_date',
-               'order_delivered_customer_date', 'order_estimated_delivery_date']
-        for i in colum:
-            orders[i] = pd.to_datetime(orders[i], format='%Y-%m-%d %H:%M:%S')
+        # datetimes are parsed at load time, see olist.schema
         # compute wait time
         orders['wait_time'] = (orders['order_delivered_customer_date'] - orders['order_purchase_timestamp']).dt.total_seconds() / 3600 / 24
         # compute expected wait time
         orders['expected_wait_time'] = (orders['order_estimated_delivery_date'] - orders['order_purchase_timestamp']).dt.total_seconds() / 3600 / 24
         # compute delay vs expected - carefully handles "negative" delays
         orders['delay_vs_expected'] = (orders['order_delivered_customer_date'] - orders['order_estimated_delivery_date']).dt.total_seconds() / 3600 / 24
-        orders['delay_vs_expected'][orders['order_delivered_customer_date'] < orders['order_estimated_delivery_date']] = 0
+        orders['delay_vs_expected'] = days_late(orders['delay_vs_expected'], orders['order_delivered_customer_date'], orders['order_estimated_delivery_date'])
 
         return orders[['order_id', 'wait_time', 'expected_wait_time', 'delay_vs_expected', 'order_status', 'order_purchase_timestamp']].dropna()
 
+    @decode_ids
+    @feature(['dim_is_five_star', 'dim_is_one_star', 'review_score'])
     def get_review_score(self):
         """
         02-01 > Returns a DataFrame with:
         order_id, dim_is_five_star, dim_is_one_star, review_score
         """
-        def dim_five_star(x):
-            if x == 5:
-                return 1
-            return 0
-
-        def dim_one_star(x):
-            if x == 1:
-                return 1
-            return 0
-
         reviews = self.data['order_reviews'].copy()
 
-        reviews["dim_is_five_star"] = reviews["review_score"].map(dim_five_star) # --> Series([0, 1, 1, 0, 0, 1 ...])
+        reviews["dim_is_five_star"] = star_indicator(reviews["review_score"], 5) # --> Series([0, 1, 1, 0, 0, 1 ...])
 
-        reviews["dim_is_one_star"] = reviews["review_score"].map(dim_one_star) # --> Series([0, 1, 1, 0, 0, 1 ...])
+        reviews["dim_is_one_star"] = star_indicator(reviews["review_score"], 1) # --> Series([0, 1, 1, 0, 0, 1 ...])
         return reviews[['order_id', 'dim_is_five_star', 'dim_is_one_star', 'review_score']]
 
+    @decode_ids(sort='order_id')
+    @feature(['number_of_products'])
     def get_number_products(self):
         """
         02-01 > Returns a DataFrame with:
@@ -79,6 +78,8 @@ class Order:
         order_items.columns = ['order_id', 'number_of_products']
         return order_items
 
+    @decode_ids(sort='order_id')
+    @feature(['number_of_sellers'])
     def get_number_sellers(self):
         """
         02-01 > Returns a DataFrame with:
@@ -89,6 +90,8 @@ class Order:
         order_items.columns = ['order_id', 'number_of_sellers']
         return order_items
 
+    @decode_ids(sort='order_id')
+    @feature(['price', 'freight_value'])
     def get_price_and_freight(self):
         """
         02-01 > Returns a DataFrame with:
@@ -97,48 +100,61 @@ class Order:
         order_items = self.data['order_items'].copy()[['order_id', 'price','freight_value']]
         return order_items.groupby('order_id').sum().reset_index()
 
+    @decode_ids(sort='order_id')
+    @feature(['distance_seller_customer'])
     def get_distance_seller_customer(self):
         """
         02-01 > Returns a DataFrame with order_id
         and distance between seller and customer
         """
-        customer_geolocations = self.data['geolocation'].copy()[['geolocation_zip_code_prefix', 'geolocation_lat', 'geolocation_lng']]
-        customer_geolocations.columns = ['customer_zip_code_prefix', 'customer_geolocation_lat', 'customer_geolocation_lng']
-        customer_geolocations = customer_geolocations.groupby('customer_zip_code_prefix').mean().reset_index()
-        seller_geolocations = self.data['geolocation'].copy()[['geolocation_zip_code_prefix', 'geolocation_lat', 'geolocation_lng']]
-        seller_geolocations.columns = ['seller_zip_code_prefix', 'seller_geolocation_lat', 'seller_geolocation_lng']
-        seller_geolocations = seller_geolocations.groupby('seller_zip_code_prefix').mean().reset_index()
-
+        centroids = Olist().get_zip_centroids()
         customers = self.data['customers'].copy()[['customer_id', 'customer_zip_code_prefix']]
         sellers = self.data['sellers'].copy()[['seller_id','seller_zip_code_prefix']]
 
-        merged = self.matching_table.merge(customers, on='customer_id', how='inner').merge(sellers, on='seller_id', how='inner')
-        merged = merged.merge(customer_geolocations, on='customer_zip_code_prefix', how='inner')
-        merged = merged.merge(seller_geolocations, on='seller_zip_code_prefix', how='inner').dropna()
-        merged['distance_seller_customer'] = merged.apply(lambda row: haversine_distance(row['customer_geolocation_lng'], row['customer_geolocation_lat'], row['seller_geolocation_lng'], row['seller_geolocation_lat']), axis = 1)
+        # one row per item: the reviews of an order would only repeat its items,
+        # but as in the matching table, orders without reviews have no distance
+        orders = self.data['orders'][['order_id', 'customer_id']]
+        items = self.data['order_items'][['order_id', 'seller_id']]
+        items = items[items['order_id'].isin(self.data['order_reviews']['order_id'])]
+        merged = profiled_merge(items, orders, on='order_id', how='inner')
+        merged = profiled_merge(merged, customers, on='customer_id', how='inner')
+        merged = profiled_merge(merged, sellers, on='seller_id', how='inner')
+        # zip code prefixes without geolocation give NaN distances, dropped below
+        customer_geolocations = centroids.reindex(merged['customer_zip_code_prefix'].values)
+        seller_geolocations = centroids.reindex(merged['seller_zip_code_prefix'].values)
+        merged['distance_seller_customer'] = haversine_distance(customer_geolocations['geolocation_lng'].values,
+                                                                customer_geolocations['geolocation_lat'].values,
+                                                                seller_geolocations['geolocation_lng'].values,
+                                                                seller_geolocations['geolocation_lat'].values)
+        merged = merged.dropna()
         merged = merged.groupby("order_id", as_index=False).agg(
             {"distance_seller_customer": "mean"}
         )
         return merged[['order_id', 'distance_seller_customer']]
 
+    @decode_ids(sort='order_id')
+    def get_features(self, columns):
+        """
+        Returns a DataFrame with 'order_id' and the requested feature `columns`,
+        only computing the get_* methods that output them.
+        """
+        return build_features(self, columns, 'order_id')
+
+    @decode_ids
+    @feature([], inputs=['get_wait_time', 'get_number_sellers', 'get_number_products',
+                     'get_review_score', 'get_price_and_freight', 'get_distance_seller_customer'])
     def get_training_data(self, is_delivered=True,
-                          with_distance_seller_customer=False):
+                          with_distance_seller_customer=False, executor=None):
         """
         02-01 > Returns a clean DataFrame (without NaN), with the following columns:
         [order_id, wait_time, expected_wait_time, delay_vs_expected, order_status,
         dim_is_five_star, dim_is_one_star, review_score, number_of_products,
         number_of_sellers, freight_value, distance_customer_seller]
+        `executor` ('thread' or 'process') computes the features concurrently.
         """
-        wait = self.get_wait_time(is_delivered)
-        sellers = self.get_number_sellers()
-        products = self.get_number_products()
-        review_score = self.get_review_score()
-        price = self.get_price_and_freight()
-        merged = wait.merge(sellers, on='order_id', how='inner')
-        merged = merged.merge(products, on='order_id', how='inner')
-        merged = merged.merge(review_score, on='order_id', how='inner')
-        merged = merged.merge(price, on='order_id', how='inner')
+        calls = [('get_wait_time', {'is_delivered': is_delivered}),
+                 'get_number_sellers', 'get_number_products',
+                 'get_review_score', 'get_price_and_freight']
         if with_distance_seller_customer == True:
-            distance = self.get_distance_seller_customer()
-            merged = merged.merge(distance, on='order_id', how='inner')
-        return merged
+            calls.append('get_distance_seller_customer')
+        return merge_tree(run_features(self, calls, executor), on='order_id')
@@ -0,0 +1,76 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from olist.ids import ID_DICTIONARY, call_interned
+from olist.profiling import profiled_merge
+
+EXECUTORS = [None, 'thread', 'process']
+
+
+def load_ids(ids):
+    """
+    Initializer of the worker processes: shares the id codes of the parent.
+    """
+    ID_DICTIONARY.__setstate__(ids)
+
+
+def run_feature(obj, name, kwargs):
+    """
+    Runs the feature `name` of `obj` in a worker process, where ids are decoded
+    before being sent back since the process may have interned new ones.
+    A forked worker inherits the call depth of the parent, so they are decoded explicitly.
+    """
+    return ID_DICTIONARY.decode_frame(getattr(obj, name)(**kwargs))
+
+
+def run_features(obj, calls, executor=None, max_workers=None):
+    """
+    Returns the frames of the features `calls` of `obj`, a list of method names
+    or (method name, kwargs) pairs, in the same order.
+    `executor` is None (serial), 'thread' or 'process'.
+    """
+    if executor not in EXECUTORS:
+        raise ValueError('executor should be one of %s' % EXECUTORS)
+    calls = [(call, {}) if isinstance(call, str) else call for call in calls]
+    if executor is None:
+        return [getattr(obj, name)(**kwargs) for name, kwargs in calls]
+    max_workers = max_workers or min(len(calls), os.cpu_count() or 1)
+    if executor == 'thread':
+        with ThreadPoolExecutor(max_workers) as pool:
+            futures = [pool.submit(call_interned, getattr(obj, name), **kwargs)
+                       for name, kwargs in calls]
+            return [future.result() for future in futures]
+    with ProcessPoolExecutor(max_workers, initializer=load_ids,
+                             initargs=(ID_DICTIONARY.__getstate__(),)) as pool:
+        futures = [pool.submit(run_feature, obj, name, kwargs) for name, kwargs in calls]
+        return [ID_DICTIONARY.encode_frame(future.result()) for future in futures]
+
+
+def merge_tree(frames, on, how='inner'):
+    """
+    Merges `frames` on `on` pairwise, as a balanced tree instead of a chain.
+    Keeps the columns and row order of the chained merges.
+    """
+    frames = [frame if on in frame.columns else frame.reset_index() for frame in frames]
+    while len(frames) > 1:
+        merged = [profiled_merge(left, right, on=on, how=how) for left, right in zip(frames[::2], frames[1::2])]
+        if len(frames) % 2:
+            merged.append(frames[-1])
+        frames = merged
+    return frames[0]
+
+
+def measure_speedup(cls, *args, executor='thread', method='get_training_data', **kwargs):
+    """
+    Returns a dict with the wall-clock time of `cls(*args).method(**kwargs)`
+    computed serially and with `executor`, and the speedup of the latter.
+    A new object is built for each run so memoized features are not reused.
+    """
+    timings = {}
+    for mode in [None, executor]:
+        obj = cls(*args)
+        start = time.perf_counter()
+        getattr(obj, method)(executor=mode, **kwargs)
+        timings[mode or 'serial'] = time.perf_counter() - start
+    timings['speedup'] = timings['serial'] / timings[executor]
+    return timings
@@ -0,0 +1,147 @@
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from olist.data import Olist
+from olist.ids import ID_DICTIONARY, call_interned
+from olist.parallel import load_ids
+from olist.profiling import profiled_merge
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.compute
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+def get_seller_order(data):
+    return data['sellers']['seller_id']
+
+
+def get_product_order(data):
+    # get_product_features keeps the products of a translated category, merged on it
+    translation = data['product_category_name_translation'][['product_category_name']]
+    return profiled_merge(data['products'], translation, on='product_category_name')['product_id']
+
+
+# for each class: the key column, the table holding one row per key,
+# the tables its get_training_data reads, and the columns and function giving the row order
+# of its first feature from the key table
+PARTITIONS = {
+    'Seller': ('seller_id', 'sellers', ['sellers', 'orders', 'order_reviews', 'order_items'],
+               {'sellers': ['seller_id']}, get_seller_order),
+    'Product': ('product_id', 'products', ['products', 'product_category_name_translation',
+                                           'orders', 'order_reviews', 'order_items'],
+                {'products': ['product_id', 'product_category_name'],
+                 'product_category_name_translation': ['product_category_name']}, get_product_order),
+}
+
+
+def write_arrow(source, path):
+    """
+    Copies the parquet file `source` into the Arrow file `path`, one row group at a time.
+    """
+    parquet = pyarrow.parquet.ParquetFile(source)
+    with pyarrow.ipc.new_file(path, parquet.schema_arrow) as writer:
+        for i in range(parquet.num_row_groups):
+            writer.write_table(parquet.read_row_group(i))
+
+
+def read_mapped(path, key):
+    """
+    Returns the Arrow table `key` memory-mapped from the folder `path`, without copying it.
+    """
+    return pyarrow.ipc.open_file(pyarrow.memory_map(os.path.join(path, key + '.arrow'))).read_all()
+
+
+def in_partition(ids, column, partition, n_partitions):
+    """
+    Returns a boolean Arrow array, True for the `ids` of `column` whose code modulo `n_partitions`
+    is `partition`. Codes are those of the parent, shared with the worker by `load_ids`.
+    """
+    codes = ID_DICTIONARY.encode(column, ids.to_pandas())
+    return pyarrow.array(np.asarray(codes) % n_partitions == partition)
+
+
+def get_partition(path, keys, key_column, key_table, partition, n_partitions):
+    """
+    Returns the tables of the partition: the keys whose code modulo `n_partitions`
+    is `partition`, the orders they appear in, with all the items and reviews of these orders.
+    """
+    items = read_mapped(path, 'order_items')
+    selected = in_partition(items.column(key_column), key_column, partition, n_partitions)
+    orders = pyarrow.compute.unique(items.column('order_id').filter(selected))
+    tables = {}
+    for key in keys:
+        table = read_mapped(path, key)
+        if key == key_table:
+            mask = in_partition(table.column(key_column), key_column, partition, n_partitions)
+        elif 'order_id' in table.column_names:
+            mask = pyarrow.compute.is_in(table.column('order_id'), value_set=orders)
+        else:
+            mask = None
+        # only the selected rows are copied out of the mapped file
+        tables[key] = (table if mask is None else table.filter(mask)).to_pandas()
+    return tables
+
+
+def build_partition(cls, path, partition, n_partitions, kwargs):
+    """
+    Worker: computes `cls().get_training_data(**kwargs)` over one partition,
+    keeping the rows of its keys, with decoded ids since the worker interns ids of its own.
+    """
+    key_column, key_table, keys, _, _ = PARTITIONS[cls.__name__]
+    olist = Olist()
+    files = dict(zip(olist.keys_names(), olist.FILE_NAMES))
+    tables = get_partition(path, keys, key_column, key_table, partition, n_partitions)
+    store = olist.get_store()
+    for key, df in tables.items():
+        store.put(files[key], df)
+    training = call_interned(cls().get_training_data, **kwargs)
+    return ID_DICTIONARY.decode_frame(training[training[key_column] % n_partitions == partition])
+
+
+def get_partitioned_training_data(cls, n_partitions=None, max_workers=None, path=None, **kwargs):
+    """
+    Returns `cls().get_training_data(**kwargs)` for `cls` Seller or Product, computed
+    by hash-partitioning the keys (seller_id or product_id) over worker processes.
+    Tables are copied from the parquet cache to memory-mapped Arrow files in `path`
+    (a temporary folder by default) shared with the workers, the parent only reads the key table,
+    and the result is the frame of the serial path.
+    """
+    olist = Olist()
+    cache = olist.get_store().cache
+    if pyarrow is None or cache is None:
+        raise RuntimeError('The partitioned computation needs pyarrow and the parquet cache')
+    key_column, key_table, keys, columns, get_order = PARTITIONS[cls.__name__]
+    n_partitions = n_partitions or os.cpu_count() or 1
+    files = dict(zip(olist.keys_names(), olist.FILE_NAMES))
+    # the keys are interned, as the workers share their codes to pick their partition
+    data = olist.get_data(columns=dict(columns, orders=['order_id']), interned=True)
+    order = ID_DICTIONARY.decode(key_column, get_order(data).values)
+    # loading the interned orders table interns every order id before ID_DICTIONARY is sent to
+    # the workers, so they group orders in the same order as the serial path
+    interned_orders = data['orders']
+    dropna = cls.__name__ == 'Seller'
+    with tempfile.TemporaryDirectory(dir=path) as folder:
+        for key in keys:
+            if cache.is_stale(files[key]):
+                cache.build(files[key])
+            write_arrow(cache.parquet_file(files[key]), os.path.join(folder, key + '.arrow'))
+        with ProcessPoolExecutor(max_workers or n_partitions, initializer=load_ids,
+                                 initargs=(ID_DICTIONARY.__getstate__(),)) as pool:
+            if dropna:
+                kwargs = dict(kwargs, dropna=False)
+            futures = [pool.submit(build_partition, cls, folder, partition, n_partitions, kwargs)
+                       for partition in range(n_partitions)]
+            training = pd.concat([future.result() for future in futures])
+    # rows in the order of the first feature, kept by the serial merges
+    position = pd.Series(np.arange(len(order)), index=order)
+    training = training.iloc[np.argsort(position.reindex(training[key_column].values).values, kind='stable')]
+    training = training.reset_index(drop=True)
+    if dropna:
+        training = training.dropna()
+    return training
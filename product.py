@@ -1,24 +1,40 @@
 import pandas as pd
 import numpy as np
 from olist.data import Olist
+from olist.ids import decode_ids
+from olist.features import feature, build_features
+from olist.kernels import review_cost
+from olist.parallel import run_features, merge_tree
 from olist.order import Order
+from olist.index import OrderIndex
+from olist.profiling import profiled_merge
 
 
 
 class Product:
+    # columns read by the methods below, for the tables they use
+    COLUMNS = {
+        'orders': ['order_id'],
+        'order_items': ['order_id', 'product_id', 'price'],
+        'order_reviews': ['order_id'],
+    }
 
     def __init__(self, *args):
 
+        # ids are interned to integer codes, public methods return them as strings
         olist = Olist()
         if args:
-            self.data = olist.get_data(args[0])
-            self.matching_table = olist.get_matching_table(args[0])
+            self.data = olist.get_data(args[0], columns=self.COLUMNS, interned=True)
             self.order = Order(args[0])
         else:
-            self.data = olist.get_data()
-            self.matching_table = olist.get_matching_table()
+            self.data = olist.get_data(columns=self.COLUMNS, interned=True)
             self.order = Order()
+        self.index = OrderIndex(self.data['orders'], self.data['order_items'], self.data['order_reviews'])
 
+    @decode_ids
+    @feature(['product_name_length', 'product_description_length', 'product_photos_qty',
+              'product_weight_g', 'product_length_cm', 'product_height_cm',
+              'product_width_cm', 'category'])
     def get_product_features(self):
         """
         Returns a DataFrame with:
@@ -30,7 +46,7 @@ class Product:
         products = self.data['products']
 
         en_category = self.data['product_category_name_translation']
-        df = products.merge(en_category, on='product_category_name')
+        df = profiled_merge(products, en_category, on='product_category_name')
         df.drop(['product_category_name'], axis=1, inplace=True)
         df.rename(columns={'product_category_name_english': 'category',
                   'product_name_lenght': 'product_name_length',
@@ -40,6 +56,8 @@ class Product:
 
         return df
 
+    @decode_ids(sort='product_id')
+    @feature(['price'])
     def get_price(self):
         """
         Return a DataFrame with:
@@ -49,47 +67,60 @@ class Product:
 
         return order_items[['product_id', 'price']].groupby('product_id').mean()
 
+    @decode_ids(sort='product_id')
+    @feature(['wait_time'], inputs=['order.get_wait_time'])
     def get_wait_time(self):
         """
         Returns a DataFrame with:
         'product_id', 'wait_time'
         """
-        matching_table = self.matching_table
+        index = self.index
         orders_wait_time = self.order.get_wait_time()
-
-        df = matching_table.merge(orders_wait_time,
-                                 on='order_id')
-
-        return df.groupby('product_id',
-                          as_index=False).agg({'wait_time': 'mean'})
-
+        wait_time = np.full(len(index), np.nan)
+        wait_time[index.positions(orders_wait_time['order_id'])] = orders_wait_time['wait_time']
+
+        pairs = index.pairs(index.item_products)
+        position = pairs['position'].values
+        # rows of the matching table of each product and order
+        rows = pairs['n'].values * index.weights(position)
+        df = pd.DataFrame({'product_id': pairs['key'].values, 'rows': rows,
+                           'wait_time': rows * wait_time[position]})
+        df = df[~np.isnan(wait_time[position])].groupby('product_id', as_index=False).sum()
+        df['wait_time'] = df['wait_time'] / df['rows']
+        return df[['product_id', 'wait_time']]
+
+    @decode_ids(sort='product_id')
+    @feature(['share_of_one_stars', 'share_of_five_stars', 'review_score', 'cost'],
+             inputs=['order.get_review_score'])
     def get_review_score(self):
         """
         Returns a DataFrame with:
         'product_id', 'share_of_five_stars', 'share_of_one_stars',
         'review_score'
         """
-        matching_table = self.matching_table
+        index = self.index
         orders_reviews = self.order.get_review_score()
-
-
-        matching_table = matching_table[['order_id',
-                                         'product_id']].drop_duplicates()
-        df = matching_table.merge(orders_reviews,
-                                  on='order_id')
-        df['cost_of_bad_reviews'] = df['review_score'].map(lambda x: 100 if x == 1 else (50 if x == 2 else (40 if x == 3 else 0)))
-
-        df = df.groupby('product_id',
-                        as_index=False).agg({'dim_is_one_star': 'mean',
-                                             'dim_is_five_star': 'mean',
-                                             'review_score': 'mean',
-                                             'cost_of_bad_reviews': 'sum'
-                                             })
+        orders_reviews = orders_reviews.assign(cost_of_bad_reviews=review_cost(orders_reviews['review_score']))
+
+        # each product of an order is joined once to each review of the order
+        pairs = index.pairs(index.item_products)
+        position = pairs['position'].values
+        df = pd.DataFrame({'product_id': pairs['key'].values, 'n_reviews': index.n_reviews[position]})
+        columns = ['dim_is_one_star', 'dim_is_five_star', 'review_score', 'cost_of_bad_reviews']
+        for column in columns:
+            df[column] = index.order_sums(orders_reviews['order_id'], orders_reviews[column])[position]
+        df = df[df['n_reviews'] > 0].groupby('product_id', as_index=False).sum()
+        for column in columns[:3]:
+            df[column] = df[column] / df['n_reviews']
+        df['cost_of_bad_reviews'] = df['cost_of_bad_reviews'].astype(np.int64)
+        df = df[['product_id'] + columns]
         df.columns = ['product_id', 'share_of_one_stars',
                       'share_of_five_stars', 'review_score', 'cost']
         return df
 
 
+    @decode_ids(sort='product_id')
+    @feature(['n_orders', 'quantity'])
     def get_quantity(self):
         """
         Returns a DataFrame with:
@@ -106,8 +137,10 @@ class Product:
                                    as_index=False).agg({'order_id': 'count'})
         quantity.columns = ['product_id', 'quantity']
 
-        return n_orders.merge(quantity, on='product_id')
+        return profiled_merge(n_orders, quantity, on='product_id')
 
+    @decode_ids(sort='product_id')
+    @feature(['sales'])
     def get_sales(self):
         """
         Returns a DataFrame with:
@@ -118,34 +151,43 @@ class Product:
             .sum()\
             .rename(columns={'price': 'sales'})
 
-    def get_training_data(self):
-
-        training_set =\
-            self.get_product_features()\
-                .merge(
-                self.get_wait_time(), on='product_id'
-               ).merge(
-                self.get_price(), on='product_id'
-               ).merge(
-                self.get_review_score(), on='product_id'
-               ).merge(
-                self.get_quantity(), on='product_id'
-               ).merge(
-                self.get_sales(), on='product_id'
-               )
+    @decode_ids(sort='product_id')
+    def get_features(self, columns):
+        """
+        Returns a DataFrame with 'product_id' and the requested feature `columns`,
+        only computing the get_* methods that output them.
+        """
+        return build_features(self, columns, 'product_id')
+
+    @decode_ids
+    @feature(['revenues', 'profits'],
+             inputs=['get_product_features', 'get_wait_time', 'get_price',
+                     'get_review_score', 'get_quantity', 'get_sales'])
+    def get_training_data(self, executor=None):
+        """
+        Returns a DataFrame with the product features, wait time, price,
+        review score, quantity, sales, revenues and profits of each product.
+        `executor` ('thread' or 'process') computes the features concurrently.
+        """
+
+        frames = run_features(self, ['get_product_features', 'get_wait_time', 'get_price',
+                                     'get_review_score', 'get_quantity', 'get_sales'], executor)
+        training_set = merge_tree(frames, on='product_id')
 
         olist_sales_cut = 0.1
         training_set['revenues'] = olist_sales_cut * training_set['sales']
         training_set['profits'] = training_set['revenues'] - training_set['cost']
         return training_set
 
+    @decode_ids
+    @feature([], inputs=['get_training_data'])
     def get_product_cat(self, agg="median"):
         '''
         Returns a DataFrame aggregating various properties for each product 'category',
         using the aggregation function passed in argument.
         The 'quantity' columns refers to the total number of product sold for this category.
         '''
-        products = self.get_training_data()
+        products = self.get_training_data().drop(columns='product_id')
         products1 = products.copy().groupby('category').sum()
         products = products.groupby('category').agg(agg)
         products['quantity'] = products1['quantity']
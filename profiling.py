@@ -0,0 +1,291 @@
+import os
+import json
+import time
+import atexit
+import functools
+import threading
+import tracemalloc
+import multiprocessing
+from collections.abc import Mapping
+import pandas as pd
+
+# a merge is reported when it returns more than MERGE_FACTOR times the rows of its largest input
+MERGE_FACTOR = 1.0
+
+_PROFILER = None
+_stacks = threading.local()
+
+
+class Stage:
+    '''
+    One timed stage: a get_* method, a table read, a schema conversion or a merge.
+    `rows_in` counts the rows of the tables read from the store while it ran,
+    `rows_out` the rows it returned, `memory_delta` the bytes it left allocated (tracemalloc).
+    '''
+
+    def __init__(self, profiler, name, category):
+        self.profiler = profiler
+        self.name = name
+        self.category = category
+        self.rows_in = 0
+        self.rows_out = None
+        self.memory_delta = None
+        self.warnings = []
+
+    def __enter__(self):
+        stack = get_stack()
+        self.depth = len(stack)
+        self.thread = threading.get_ident()
+        stack.append(self)
+        self.memory = tracemalloc.get_traced_memory()[0] if self.profiler.memory else None
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.duration = time.perf_counter() - self.start
+        if self.memory is not None:
+            self.memory_delta = tracemalloc.get_traced_memory()[0] - self.memory
+        get_stack().pop()
+        self.profiler.record(self)
+        return False
+
+    def output(self, result):
+        """
+        Records the number of rows of `result` and returns it.
+        """
+        if hasattr(result, 'shape') and not isinstance(result, Mapping):
+            self.rows_out = int(result.shape[0])
+        return result
+
+    def warn(self, message):
+        self.warnings.append(message)
+
+    def to_dict(self):
+        return {'name': self.name, 'category': self.category, 'start': self.start - self.profiler.start,
+                'seconds': self.duration, 'rows_in': self.rows_in, 'rows_out': self.rows_out,
+                'memory_delta': self.memory_delta, 'thread': self.thread, 'depth': self.depth,
+                'warnings': list(self.warnings)}
+
+
+class NullStage:
+    '''
+    Stage returned when profiling is disabled, doing nothing.
+    '''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def output(self, result):
+        return result
+
+    def warn(self, message):
+        pass
+
+
+NULL_STAGE = NullStage()
+
+
+class Profiler:
+    '''
+    Collects the stages run while it is enabled, from every thread of the process
+    (worker processes are not profiled). `memory=True` traces allocations with tracemalloc,
+    which slows the code down.
+    '''
+
+    def __init__(self, memory=True):
+        self.memory = memory
+        self.start = time.perf_counter()
+        self.stages = []
+        self._lock = threading.Lock()
+
+    def stage(self, name, category='stage'):
+        return Stage(self, name, category)
+
+    def record(self, stage):
+        with self._lock:
+            self.stages.append(stage)
+
+    def to_frame(self):
+        """
+        Returns a DataFrame with one row per stage, in the order they ended:
+        'name', 'category', 'start', 'seconds', 'rows_in', 'rows_out',
+        'memory_delta' (bytes), 'thread', 'depth' (nesting) and 'warnings'.
+        """
+        return pd.DataFrame([stage.to_dict() for stage in self.stages],
+                            columns=['name', 'category', 'start', 'seconds', 'rows_in', 'rows_out',
+                                     'memory_delta', 'thread', 'depth', 'warnings'])
+
+    def summary(self):
+        """
+        Returns a DataFrame indexed by stage name with its number of 'calls',
+        total 'seconds', 'rows_in', 'rows_out', 'memory_delta' and 'warnings', slowest first.
+        """
+        df = self.to_frame()
+        df['calls'] = 1
+        df['warnings'] = df['warnings'].str.len()
+        summary = df.groupby('name').agg({'calls': 'sum', 'seconds': 'sum', 'rows_in': 'sum',
+                                          'rows_out': 'sum', 'memory_delta': 'sum', 'warnings': 'sum'})
+        return summary.sort_values('seconds', ascending=False)
+
+    def warnings(self):
+        return [(stage.name, message) for stage in self.stages for message in stage.warnings]
+
+    def to_json(self, path=None):
+        """
+        Returns the stages as a JSON string, written to `path` when given.
+        """
+        text = json.dumps([stage.to_dict() for stage in self.stages], indent=1)
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(text)
+        return text
+
+    def to_chrome_trace(self, path=None):
+        """
+        Returns the stages in the Chrome trace event format, written to `path` when given.
+        Open it in chrome://tracing or https://ui.perfetto.dev.
+        """
+        events = []
+        for stage in self.stages:
+            start = (stage.start - self.start) * 1e6
+            events.append({'name': stage.name, 'cat': stage.category, 'ph': 'X', 'ts': start,
+                           'dur': stage.duration * 1e6, 'pid': os.getpid(), 'tid': stage.thread,
+                           'args': {'rows_in': stage.rows_in, 'rows_out': stage.rows_out,
+                                    'memory_delta': stage.memory_delta}})
+            events.extend({'name': message, 'cat': 'warning', 'ph': 'i', 's': 't',
+                           'ts': start + stage.duration * 1e6, 'pid': os.getpid(), 'tid': stage.thread}
+                          for message in stage.warnings)
+        trace = {'traceEvents': events, 'displayTimeUnit': 'ms'}
+        if path is not None:
+            with open(path, 'w') as f:
+                json.dump(trace, f)
+        return trace
+
+
+def get_stack():
+    if not hasattr(_stacks, 'stages'):
+        _stacks.stages = []
+    return _stacks.stages
+
+
+def stage(name, category='stage'):
+    """
+    Returns a context manager timing the stage `name` when profiling is enabled,
+    a shared no-op one otherwise.
+    """
+    profiler = _PROFILER
+    if profiler is None:
+        return NULL_STAGE
+    return profiler.stage(name, category)
+
+
+def profiled(method):
+    """
+    Decorator recording each call of `method` as a stage when profiling is enabled.
+    """
+    name = method.__qualname__
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        if _PROFILER is None:
+            return method(*args, **kwargs)
+        with _PROFILER.stage(name, 'method') as current:
+            return current.output(method(*args, **kwargs))
+    return wrapper
+
+
+def rows_read(n):
+    """
+    Adds `n` rows read from the store to the stages running in this thread.
+    """
+    if _PROFILER is None:
+        return
+    for current in get_stack():
+        current.rows_in += n
+
+
+def check_merge(current, left, right, result, on):
+    if len(result) > MERGE_FACTOR * max(len(left), len(right), 1):
+        current.warn('merge on %s: %d x %d rows -> %d rows, duplicated keys on both sides'
+                     % (on, len(left), len(right), len(result)))
+    elif len(result) == 0 and len(left) and len(right):
+        current.warn('merge on %s: %d x %d rows -> no rows' % (on, len(left), len(right)))
+
+
+def profiled_merge(left, right, **kwargs):
+    """
+    Returns `left.merge(right, **kwargs)`, recorded as a stage with its cardinality checked
+    when profiling is enabled. The package merges through it, other merges are not profiled.
+    """
+    profiler = _PROFILER
+    if profiler is None:
+        return left.merge(right, **kwargs)
+    on = kwargs.get('on')
+    with profiler.stage('merge on %s' % (on,), 'merge') as current:
+        result = current.output(left.merge(right, **kwargs))
+        check_merge(current, left, right, result, on)
+        current.rows_in = len(left) + len(right)
+        return result
+
+
+def enable(memory=True):
+    """
+    Starts profiling and returns the Profiler collecting the stages.
+    """
+    global _PROFILER
+    if _PROFILER is not None:
+        disable()
+    profiler = Profiler(memory)
+    profiler.started_tracemalloc = memory and not tracemalloc.is_tracing()
+    if profiler.started_tracemalloc:
+        tracemalloc.start()
+    _PROFILER = profiler
+    return profiler
+
+
+def disable():
+    """
+    Stops profiling and returns the Profiler that was enabled, if any.
+    """
+    global _PROFILER
+    profiler, _PROFILER = _PROFILER, None
+    if profiler is not None and profiler.started_tracemalloc:
+        tracemalloc.stop()
+    return profiler
+
+
+class profiling:
+    '''
+    Context manager profiling the code it runs:
+
+        with profiling() as profiler:
+            Seller().get_training_data()
+        profiler.summary()
+    '''
+
+    def __init__(self, memory=True):
+        self.memory = memory
+
+    def __enter__(self):
+        return enable(self.memory)
+
+    def __exit__(self, *exc_info):
+        disable()
+        return False
+
+
+def profile_to(path):
+    """
+    Profiles the whole process and writes its Chrome trace to `path` at exit,
+    as done on import when OLIST_PROFILE is set.
+    """
+    profiler = enable()
+    atexit.register(lambda: profiler.to_chrome_trace(path))
+    return profiler
+
+
+if os.environ.get('OLIST_PROFILE') and multiprocessing.parent_process() is None:
+    profile_to(os.environ['OLIST_PROFILE'])
@@ -0,0 +1,193 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from olist.parallel import EXECUTORS
+
+# floats of row outer products held at once while summing X'X
+BLOCK_SIZE = 2 ** 22
+
+
+def design_matrix(df, y, x):
+    """
+    Returns the response vector, the design matrix (with an intercept), the names of its
+    columns and the index of the rows kept, like statsmodels' `ols('y ~ x1 + x2', df)`:
+    rows with missing values are dropped, categorical columns are dummy encoded
+    against their first level.
+    """
+    df = df[[y] + list(x)].dropna()
+    columns = [pd.Series(1.0, index=df.index, name='Intercept')]
+    for column in x:
+        if isinstance(df[column].dtype, pd.CategoricalDtype) or df[column].dtype == object:
+            dummies = pd.get_dummies(df[column].astype('category').cat.remove_unused_categories(),
+                                     drop_first=True, dtype=float)
+            columns.extend(dummies[level].rename('%s[T.%s]' % (column, level)) for level in dummies.columns)
+        else:
+            columns.append(df[column].astype(float))
+    X = pd.concat(columns, axis=1)
+    return df[y].values.astype(float), X.values, list(X.columns), df.index
+
+
+def solve(XtX, Xty):
+    """
+    Returns the coefficients and the inverse of X'X of a stack of normal equations.
+    The pseudo-inverse is used, as statsmodels does, so rank deficient groups still solve.
+    """
+    inverse = np.linalg.pinv(XtX)
+    return np.einsum('gpq,gq->gp', inverse, Xty), inverse
+
+
+def outer_blocks(X):
+    """
+    Yields the rows slice and the (rows, p * p) outer products of consecutive blocks of rows of `X`,
+    each block holding at most BLOCK_SIZE floats, so memory does not grow with the number of rows.
+    """
+    n, p = X.shape
+    rows = max(1, BLOCK_SIZE // (p * p))
+    for start in range(0, n, rows):
+        block = X[start:start + rows]
+        yield slice(start, start + rows), (block[:, :, None] * block[:, None, :]).reshape(len(block), p * p)
+
+
+def group_gram(X, codes, n_groups):
+    """
+    Returns the (n_groups, p, p) X'X of each group of the rows of `X`, `codes` being sorted.
+    """
+    p = X.shape[1]
+    XtX = np.zeros((n_groups, p * p))
+    for rows, outer in outer_blocks(X):
+        block_codes = codes[rows]
+        starts = np.flatnonzero(np.r_[True, block_codes[1:] != block_codes[:-1]])
+        XtX[block_codes[starts]] += np.add.reduceat(outer, starts, axis=0)
+    return XtX.reshape(n_groups, p, p)
+
+
+def weighted_gram(X, weights):
+    """
+    Returns the (len(weights), p, p) X'X of `X` with each vector of row weights.
+    """
+    p = X.shape[1]
+    XtX = np.zeros((len(weights), p * p))
+    for rows, outer in outer_blocks(X):
+        XtX += weights[:, rows] @ outer
+    return XtX.reshape(len(weights), p, p)
+
+
+def fit_stack(X, y, codes, n_groups):
+    """
+    Fits one OLS per group of rows (`codes` numbering the groups) at once.
+    Returns the coefficients, their standard errors and the residual degrees of freedom per group.
+    """
+    order = np.argsort(codes, kind='stable')
+    X, y, codes = X[order], y[order], codes[order]
+    starts = np.searchsorted(codes, np.arange(n_groups))
+    XtX = group_gram(X, codes, n_groups)
+    Xty = np.add.reduceat(X * y[:, None], starts, axis=0)
+    params, inverse = solve(XtX, Xty)
+    residuals = y - np.einsum('np,np->n', X, params[codes])
+    rank = np.linalg.matrix_rank(XtX)
+    df_resid = np.bincount(codes, minlength=n_groups) - rank
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scale = np.bincount(codes, weights=residuals ** 2, minlength=n_groups) / df_resid
+        bse = np.sqrt(scale[:, None] * np.diagonal(inverse, axis1=1, axis2=2))
+    return params, bse, df_resid
+
+
+def significance_table(params, bse, df_resid, names, alpha=0.05):
+    """
+    Returns a tidy DataFrame with one row per group and variable: 'variable', 'coef',
+    'std_err', 't', 'p_value', 'ci_low', 'ci_high' and 'significant' (p_value < alpha).
+    p-values follow the t distribution, as statsmodels' OLS results.
+    """
+    from scipy import stats
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = params / bse
+    dof = df_resid[:, None]
+    critical = stats.t.ppf(1 - alpha / 2, dof)
+    table = pd.DataFrame({'group': np.repeat(np.arange(len(params)), len(names)),
+                          'variable': np.tile(names, len(params)),
+                          'coef': params.ravel(), 'std_err': bse.ravel(), 't': t.ravel(),
+                          'p_value': (2 * stats.t.sf(np.abs(t), dof)).ravel(),
+                          'ci_low': (params - critical * bse).ravel(),
+                          'ci_high': (params + critical * bse).ravel()})
+    table['significant'] = table['p_value'] < alpha
+    return table
+
+
+def run_chunks(function, chunks, executor=None, max_workers=None):
+    """
+    Returns [function(*chunk) for chunk in chunks], computed by `executor`
+    (None for serial, 'thread' or 'process').
+    """
+    if executor not in EXECUTORS:
+        raise ValueError('executor should be one of %s' % EXECUTORS)
+    if executor is None:
+        return [function(*chunk) for chunk in chunks]
+    pool = ThreadPoolExecutor if executor == 'thread' else ProcessPoolExecutor
+    with pool(max_workers or min(len(chunks), os.cpu_count() or 1)) as pool:
+        return list(pool.map(function, *zip(*chunks)))
+
+
+def fit_groups(df, y, x, by=None, alpha=0.05, executor=None, max_workers=None):
+    """
+    Fits `y ~ x` (OLS with intercept) on each group of `df` split by the columns `by`
+    (the whole frame when None) from a single design matrix.
+    Returns a tidy significance table (see significance_table) with the `by` columns.
+    `executor` ('thread' or 'process') splits the groups between workers.
+    """
+    response, X, names, index = design_matrix(df, y, x)
+    if by is None:
+        keys = pd.DataFrame(index=[0])
+        codes = np.zeros(len(response), dtype=np.int64)
+    else:
+        by = [by] if isinstance(by, str) else list(by)
+        grouped = df.loc[index, by].groupby(by, observed=True, sort=True)
+        codes = grouped.ngroup().values
+        keys = grouped.size().reset_index()[by]
+    n_groups = len(keys)
+    n_chunks = 1 if executor is None else min(n_groups, max_workers or os.cpu_count() or 1)
+    bounds = np.linspace(0, n_groups, n_chunks + 1).astype(np.int64)
+    chunks = []
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        rows = (codes >= start) & (codes < stop)
+        chunks.append((X[rows], response[rows], codes[rows] - start, stop - start))
+    fits = run_chunks(fit_stack, chunks, executor, max_workers)
+    params, bse, df_resid = (np.concatenate(parts) for parts in zip(*fits))
+    table = significance_table(params, bse, df_resid, names, alpha)
+    keys = keys.iloc[table['group'].values].reset_index(drop=True)
+    return pd.concat([keys, table.drop(columns='group')], axis=1)
+
+
+def bootstrap_stack(X, y, seed, n_resamples):
+    """
+    Returns the coefficients of `n_resamples` bootstrap resamples of the rows,
+    each resample being a vector of row weights.
+    """
+    rng = np.random.default_rng(seed)
+    weights = rng.multinomial(len(y), np.full(len(y), 1 / len(y)), size=n_resamples).astype(float)
+    XtX = weighted_gram(X, weights)
+    return solve(XtX, weights @ (X * y[:, None]))[0]
+
+
+def bootstrap(df, y, x, n_resamples=1000, alpha=0.05, seed=None, chunksize=100,
+              executor=None, max_workers=None):
+    """
+    Returns a tidy significance table of `y ~ x` from `n_resamples` bootstrap resamples:
+    'variable', 'coef' (fit on all rows), 'std_err' (of the resampled coefficients),
+    'ci_low' and 'ci_high' (percentile interval), 'p_value' (share of resamples
+    on the other side of 0, two-sided) and 'significant'.
+    Resamples are solved `chunksize` at a time, split between workers by `executor`.
+    """
+    response, X, names, _ = design_matrix(df, y, x)
+    coef = solve((X.T @ X)[None], (X.T @ response)[None])[0][0]
+    sizes = [min(chunksize, n_resamples - start) for start in range(0, n_resamples, chunksize)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    chunks = [(X, response, chunk_seed, size) for chunk_seed, size in zip(seeds, sizes)]
+    resampled = np.concatenate(run_chunks(bootstrap_stack, chunks, executor, max_workers))
+    p_value = 2 * np.minimum((resampled <= 0).mean(axis=0), (resampled >= 0).mean(axis=0))
+    table = pd.DataFrame({'variable': names, 'coef': coef, 'std_err': resampled.std(axis=0, ddof=1),
+                          'ci_low': np.quantile(resampled, alpha / 2, axis=0),
+                          'ci_high': np.quantile(resampled, 1 - alpha / 2, axis=0),
+                          'p_value': np.minimum(p_value, 1)})
+    table['significant'] = table['p_value'] < alpha
+    return table
@@ -0,0 +1,86 @@
+import json
+import hashlib
+import pandas as pd
+from olist.profiling import stage
+
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# dtypes applied to each csv when it is loaded, columns not listed keep the dtype read from the csv
+SCHEMA = {
+    'olist_geolocation_dataset.csv': {
+        'geolocation_zip_code_prefix': 'int32',
+        'geolocation_city': 'category',
+        'geolocation_state': 'category',
+    },
+    'product_category_name_translation.csv': {},
+    'olist_customers_dataset.csv': {
+        'customer_zip_code_prefix': 'int32',
+        'customer_city': 'category',
+        'customer_state': 'category',
+    },
+    'olist_sellers_dataset.csv': {
+        'seller_zip_code_prefix': 'int32',
+        'seller_city': 'category',
+        'seller_state': 'category',
+    },
+    'olist_order_payments_dataset.csv': {
+        'payment_sequential': 'int16',
+        'payment_type': 'category',
+        'payment_installments': 'int16',
+    },
+    'olist_orders_dataset.csv': {
+        'order_status': 'category',
+        'order_purchase_timestamp': 'datetime64[ns]',
+        'order_approved_at': 'datetime64[ns]',
+        'order_delivered_carrier_date': 'datetime64[ns]',
+        'order_delivered_customer_date': 'datetime64[ns]',
+        'order_estimated_delivery_date': 'datetime64[ns]',
+    },
+    'olist_order_reviews_dataset.csv': {
+        'review_score': 'int8',
+        'review_creation_date': 'datetime64[ns]',
+        'review_answer_timestamp': 'datetime64[ns]',
+    },
+    'olist_order_items_dataset.csv': {
+        'order_item_id': 'int16',
+        'shipping_limit_date': 'datetime64[ns]',
+    },
+    'olist_products_dataset.csv': {
+        'product_category_name': 'category',
+        # integer counts and sizes with missing values, exact in float32
+        'product_name_lenght': 'float32',
+        'product_description_lenght': 'float32',
+        'product_photos_qty': 'float32',
+        'product_weight_g': 'float32',
+        'product_length_cm': 'float32',
+        'product_height_cm': 'float32',
+        'product_width_cm': 'float32',
+    },
+}
+
+
+def apply_schema(file, df):
+    """
+    Returns `df` with the dtypes declared for `file` in SCHEMA,
+    leaving the columns already typed untouched.
+    """
+    converted = {}
+    for column, dtype in SCHEMA.get(file, {}).items():
+        if column not in df.columns or str(df[column].dtype) == dtype:
+            continue
+        if dtype.startswith('datetime'):
+            with stage('to_datetime ' + column, 'schema'):
+                converted[column] = pd.to_datetime(df[column], format=DATETIME_FORMAT)
+        else:
+            with stage('astype ' + column, 'schema'):
+                converted[column] = df[column].astype(dtype)
+    return df.assign(**converted) if converted else df
+
+
+def schema_version(file):
+    """
+    Returns a short hash of the schema of `file`, stored with its parquet copy
+    so that the cache is rebuilt when the schema changes.
+    """
+    declared = json.dumps(SCHEMA.get(file, {}), sort_keys=True)
+    return hashlib.md5(declared.encode()).hexdigest()[:8]
@@ -1,23 +1,50 @@
 import pandas as pd
 import numpy as np
 from olist.data import Olist
+from olist.ids import decode_ids
+from olist.features import feature, build_features
+from olist.kernels import positive_part, review_cost
+from olist.parallel import run_features, merge_tree
 from olist.order import Order
+from olist.index import OrderIndex
+
+
+def get_order_delays(index, orders, order_items):
+    """
+    Returns, for each order of `index`: whether it was delivered, its wait time
+    and the summed delay to carrier of its items (in days).
+    """
+    delivered = index.order_values((orders['order_status'] == 'delivered').astype(float)) == 1
+    wait_time = index.order_values((orders['order_delivered_customer_date'] - orders['order_purchase_timestamp']) / np.timedelta64(24, 'h'))
+    carrier = index.order_values(orders['order_delivered_carrier_date'])[index.positions(order_items['order_id'])]
+    difff = (carrier - order_items['shipping_limit_date']) / np.timedelta64(24, 'h')
+    return delivered, wait_time, index.order_sums(order_items['order_id'], positive_part(difff))
 
 
 class Seller:
+    # columns read by the methods below, for the tables they use
+    COLUMNS = {
+        'sellers': ['seller_id', 'seller_city', 'seller_state'],
+        'orders': ['order_id', 'order_status', 'order_purchase_timestamp', 'order_approved_at',
+                   'order_delivered_carrier_date', 'order_delivered_customer_date'],
+        'order_items': ['order_id', 'seller_id', 'shipping_limit_date', 'price'],
+        'order_reviews': ['order_id'],
+    }
 
     def __init__(self, *args):
 
+        # ids are interned to integer codes, public methods return them as strings
         olist = Olist()
         if args:
-            self.data = olist.get_data(args[0])
-            self.matching_table = olist.get_matching_table(args[0])
+            self.data = olist.get_data(args[0], columns=self.COLUMNS, interned=True)
             self.order = Order(args[0])
         else:
-            self.data = olist.get_data()
-            self.matching_table = olist.get_matching_table()
+            self.data = olist.get_data(columns=self.COLUMNS, interned=True)
             self.order = Order()
+        self.index = OrderIndex(self.data['orders'], self.data['order_items'], self.data['order_reviews'])
 
+    @decode_ids
+    @feature(['seller_city', 'seller_state'])
     def get_seller_features(self):
         """
         Returns a DataFrame with:
@@ -26,71 +53,94 @@ class Seller:
         sellers = self.data['sellers']
         return sellers[['seller_id', 'seller_city', 'seller_state']]
 
+    @decode_ids(sort='seller_id')
+    @feature(['wait_time', 'delay_to_carrier'])
     def get_seller_delay_wait_time(self):
         """
         Returns a DataFrame with:
        'seller_id', 'delay_to_carrier', 'seller_wait_time'
         """
-        def delay(x):
-            if x > 0:
-                return abs(x)
-            return 0
-
-        orders = self.data['orders'].query("order_status=='delivered'").copy()
-        order_items = self.data['order_items'][['order_id', 'shipping_limit_date']].copy()
-        values = self.matching_table[['order_id','seller_id']].merge(orders, on='order_id', how='inner')
-        values = values.merge(order_items, on='order_id', how='inner')
-        colum = ['order_purchase_timestamp', 'order_delivered_carrier_date', 'order_delivered_customer_date', 'shipping_limit_date']
-        for i in colum:
-            values[i] = pd.to_datetime(values[i], format='%Y-%m-%d %H:%M:%S')
-        values['wait_time'] = (values['order_delivered_customer_date'] - values['order_purchase_timestamp']) / np.timedelta64(24, 'h')
-        values['difff'] = (values['order_delivered_carrier_date'] - values['shipping_limit_date']) / np.timedelta64(24, 'h')
-        values["delay_to_carrier"] = values["difff"].map(delay) # --> Series([0, 1, 1, 0, 0, 1 ...])
-        values = values[['seller_id', 'wait_time', 'delay_to_carrier']].dropna()
-        return values.groupby('seller_id', as_index=False).mean()
-
+        index = self.index
+        # each item of a seller is compared to every item of the order
+        delivered, wait_time, delay_to_carrier = get_order_delays(index, self.data['orders'], self.data['order_items'])
+
+        pairs = index.pairs(index.item_sellers)
+        position = pairs['position'].values
+        rows = pairs['n'].values * index.weights(position)
+        weight = rows * index.n_items[position]
+        values = pd.DataFrame({'seller_id': pairs['key'], 'weight': weight,
+                               'wait_time': weight * wait_time[position],
+                               'delay_to_carrier': rows * delay_to_carrier[position]})
+        values = values[delivered[position] & ~np.isnan(wait_time[position])]
+        values = values.groupby('seller_id', as_index=False).sum()
+        values['wait_time'] = values['wait_time'] / values['weight']
+        values['delay_to_carrier'] = values['delay_to_carrier'] / values['weight']
+        return values[['seller_id', 'wait_time', 'delay_to_carrier']]
+
+    @decode_ids(sort='seller_id')
+    @feature(['date_first_sale', 'date_last_sale'])
     def get_active_dates(self):
         """
         Returns a DataFrame with:
        'seller_id', 'date_first_sale', 'date_last_sale'
         """
-        orders = self.data['orders'][['order_id','order_approved_at']].copy()
-        values = self.matching_table[['order_id','seller_id']].merge(orders, on='order_id', how='right')
-        colum = ['order_approved_at']
-        for i in colum:
-            values[i] = pd.to_datetime(values[i], format='%Y-%m-%d %H:%M:%S')
-        # values['date_last_sale'] = values.groupby('seller_id').max().reset_index()['order_approved_at']
-        values['date_first_sale'] = values['order_approved_at']
-        values['date_last_sale'] = values['order_approved_at']
+        index = self.index
+        approved_at = index.order_values(self.data['orders']['order_approved_at'])
+        pairs = index.pairs(index.item_sellers)
+        pairs = pairs[index.has_order[pairs['position'].values]]
+        values = pd.DataFrame({'seller_id': pairs['key'].values,
+                               'date_first_sale': approved_at[pairs['position'].values]})
+        values['date_last_sale'] = values['date_first_sale']
         values = values.groupby('seller_id').agg({'date_first_sale': 'min', 'date_last_sale':'max'}).reset_index()
         return values[['seller_id', 'date_first_sale', 'date_last_sale']]
 
+    @decode_ids(sort='seller_id')
+    @feature(['share_of_five_stars', 'share_of_one_stars', 'review_score', 'costs'],
+             inputs=['order.get_review_score'])
     def get_review_score(self):
         """
         Returns a DataFrame with:
         'seller_id', 'share_of_five_stars', 'share_of_one_stars',
         'review_score'
         """
-        reviews = Order().get_review_score()
-        values = self.matching_table[['order_id','seller_id']].merge(reviews, on='order_id', how='inner')
-        values['cost_of_bad_reviews'] = values['review_score'].map(lambda x: 100 if x == 1 else (50 if x == 2 else (40 if x == 3 else 0)))
-        values = values.groupby('seller_id', as_index=False).agg({'dim_is_five_star': 'mean', \
-            'dim_is_one_star': 'mean', 'review_score': 'mean', 'cost_of_bad_reviews': 'sum'})
+        reviews = self.order.get_review_score()
+        index = self.index
+        pairs = index.pairs(index.item_sellers)
+        position = pairs['position'].values
+        # every row of the matching table is joined to each review of its order
+        rows = pairs['n'].values * index.weights(position)
+        values = pd.DataFrame({'seller_id': pairs['key'].values,
+                               'n_reviews': rows * index.n_reviews[position]})
+        for column in ['dim_is_five_star', 'dim_is_one_star', 'review_score']:
+            values[column] = rows * index.order_sums(reviews['order_id'], reviews[column])[position]
+        values['costs'] = rows * index.order_sums(reviews['order_id'], review_cost(reviews['review_score']))[position]
+        values = values[values['n_reviews'] > 0].groupby('seller_id', as_index=False).sum()
+        for column in ['dim_is_five_star', 'dim_is_one_star', 'review_score']:
+            values[column] = values[column] / values['n_reviews']
+        values['costs'] = values['costs'].astype(np.int64)
+        values = values[['seller_id', 'dim_is_five_star', 'dim_is_one_star', 'review_score', 'costs']]
         values.columns = ['seller_id', 'share_of_five_stars', 'share_of_one_stars', 'review_score', 'costs']
         return values.dropna()
 
+    @decode_ids(sort='seller_id')
+    @feature(['n_orders', 'quantity', 'quantity_per_order'])
     def get_quantity(self):
         """
         Returns a DataFrame with:
         'seller_id', 'n_orders', 'quantity', 'quantity_per_order'
         """
-        values = self.matching_table[['order_id','seller_id','product_id']]
-        df = values.groupby('seller_id', as_index=False).aggregate({'order_id': 'nunique',
-                                      'product_id': 'count'})
-        df.columns = ['seller_id', 'n_orders', 'quantity']
-        df['quantity_per_order'] = values.groupby(['seller_id','order_id'], as_index=False).count().groupby('seller_id', as_index=False).mean()['product_id']
+        index = self.index
+        pairs = index.pairs(index.item_sellers)
+        # rows of the matching table of each seller and order
+        values = pd.DataFrame({'seller_id': pairs['key'].values,
+                               'rows': pairs['n'].values * index.weights(pairs['position'].values)})
+        df = values.groupby('seller_id', as_index=False).agg(n_orders=('rows', 'size'),
+                                                             quantity=('rows', 'sum'),
+                                                             quantity_per_order=('rows', 'mean'))
         return df.dropna()
 
+    @decode_ids(sort='seller_id')
+    @feature(['sales'])
     def get_sales(self):
         """
         Returns a DataFrame with:
@@ -101,46 +151,99 @@ class Seller:
         orders['sales'] = orders['price']
         return orders[['seller_id', 'sales']].dropna()
 
-    def get_training_data(self):
+    @decode_ids(sort='seller_id')
+    def get_features(self, columns):
+        """
+        Returns a DataFrame with 'seller_id' and the requested feature `columns`,
+        only computing the get_* methods that output them.
+        """
+        return build_features(self, columns, 'seller_id')
+
+    @decode_ids
+    @feature(['revenues', 'profits'],
+             inputs=['get_seller_features', 'get_seller_delay_wait_time', 'get_active_dates',
+                     'get_review_score', 'get_quantity', 'get_sales'])
+    def get_training_data(self, executor=None, dropna=True):
         """
         Returns a DataFrame with:
         'seller_id', 'seller_state', 'seller_city', 'delay_to_carrier',
         'seller_wait_time', 'share_of_five_stars', 'share_of_one_stars',
         'seller_review_score', 'n_orders', 'quantity', 'date_first_sale', 'date_last_sale', 'sales'
+        `executor` ('thread' or 'process') computes the features concurrently.
+        `dropna=False` keeps the sellers with missing values.
         """
 
-        seller_features = self.get_seller_features()
-        delay_wait_time = self.get_seller_delay_wait_time()
-        active_dates = self.get_active_dates()
-        review_score = self.get_review_score()
-        quantity = self.get_quantity()
-        sales = self.get_sales()
-        seller = seller_features.merge(delay_wait_time, on='seller_id', how='inner' )
-        seller = seller.merge(active_dates, on='seller_id', how='inner' )
-        seller = seller.merge(review_score, on='seller_id', how='inner' )
-        seller = seller.merge(quantity, on='seller_id', how='inner' )
-        seller = seller.merge(sales, on='seller_id', how='inner' )
+        frames = run_features(self, ['get_seller_features', 'get_seller_delay_wait_time',
+                                     'get_active_dates', 'get_review_score',
+                                     'get_quantity', 'get_sales'], executor)
+        seller = merge_tree(frames, on='seller_id')
         seller['cost_monthly'] = np.floor(((seller['date_last_sale'] - seller['date_first_sale']) / np.timedelta64(1, 'M')))
         seller.loc[seller['cost_monthly'] == 0, 'cost_monthly'] = 1
         seller['cost_monthly']  = seller['cost_monthly'] * 80
         seller['revenues'] = np.round((seller['sales'] * 0.1) + seller['cost_monthly'], 2)
         del seller['cost_monthly']
         seller['profits'] = seller['revenues'] - seller['costs']
-        return seller.dropna()
+        return seller.dropna() if dropna else seller
 
-    def get_seller_history(self):
+    @decode_ids(sort=['seller_id', 'period'])
+    def get_seller_history(self, freq='M', window=3):
         '''
-        Returns a DataFrame aggregating various properties for each product 'category',
-        using the aggregation function passed in argument.
-        The 'quantity' columns refers to the total number of product sold for this category.
+        Returns a DataFrame with one row per seller and period (`freq` 'M' for months,
+        'W' for weeks) of `order_approved_at` in which the seller had orders:
+        'seller_id', 'period', 'n_orders', 'sales', 'review_score', 'delay_to_carrier',
+        'costs', 'revenues', 'profits', and the same metrics over the last `window` periods
+        (the current one included) suffixed with '_rolling'.
+        Orders are weighted as in get_review_score and get_seller_delay_wait_time,
+        revenues count the monthly subscription for each period with orders.
         '''
-        orders = self.data['orders'][['order_id', 'order_approved_at']]
-
-        sellers = self.get_training_data()
-        order_id = Order().get_training_data()
-        sellers = sellers.merge(self.matching_table[['order_id', ]])
-        products1 = products.copy().groupby('category').sum()
-        products = products.groupby('category').agg(agg)
-        products['quantity'] = products1['quantity']
-        return products
+        index = self.index
+        orders = self.data['orders']
+        order_items = self.data['order_items']
+        reviews = self.order.get_review_score()
+        delivered, wait_time, delay_to_carrier = get_order_delays(index, orders, order_items)
+
+        pairs = index.pairs(index.item_sellers, sales=order_items['price'])
+        position = pairs['position'].values
+        rows = pairs['n'].values * index.weights(position)
+        delay_weight = np.where(delivered[position] & ~np.isnan(wait_time[position]),
+                                rows * index.n_items[position], 0)
+        approved_at = pd.Series(index.order_values(orders['order_approved_at'])[position])
+        values = pd.DataFrame({'seller_id': pairs['key'].values,
+                               'period': approved_at.dt.to_period(freq).values,
+                               'n_orders': 1,
+                               'sales': pairs['sales'].values,
+                               'review_weight': rows * index.n_reviews[position],
+                               'review_score': rows * index.order_sums(reviews['order_id'], reviews['review_score'])[position],
+                               'delay_weight': delay_weight,
+                               'delay_to_carrier': np.where(delay_weight > 0, rows * delay_to_carrier[position], 0),
+                               'costs': rows * index.order_sums(reviews['order_id'], review_cost(reviews['review_score']))[position]})
+        values = values[approved_at.notna().values]
+        history = values.groupby(['seller_id', 'period'], as_index=False).sum()
+
+        # rolling sums: cumulative sums of each seller over its rows sorted by period,
+        # each window starting at the first period of the seller within `window` periods
+        sums = ['n_orders', 'sales', 'review_weight', 'review_score', 'delay_weight', 'delay_to_carrier', 'costs']
+        ordinals = pd.PeriodIndex(history['period'], freq=freq).asi8
+        ordinals = ordinals - ordinals.min(initial=0)
+        sellers = history['seller_id'].values.astype(np.int64)
+        keys = sellers * (ordinals.max(initial=0) + 1) + ordinals
+        starts = np.searchsorted(keys, keys - np.minimum(window - 1, ordinals))
+        firsts = np.searchsorted(sellers, sellers)
+        # per seller, so the sums do not depend on the rows (and codes) of the other sellers
+        cumulated = history.groupby('seller_id', sort=False)[sums].cumsum().values
+        before = np.where((starts > firsts)[:, None], cumulated[np.maximum(starts - 1, 0)], 0)
+        rolling = cumulated - before
+        for i, column in enumerate(sums):
+            history[column + '_rolling'] = rolling[:, i].astype(history[column].dtype)
+        n_periods = {'': 1, '_rolling': np.arange(len(history)) - starts + 1}
+
+        subscription = 80 if freq == 'M' else 80 * 12 / 52
+        for suffix in ['', '_rolling']:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                history['review_score' + suffix] = history['review_score' + suffix] / history['review_weight' + suffix]
+                history['delay_to_carrier' + suffix] = history['delay_to_carrier' + suffix] / history['delay_weight' + suffix]
+            history['revenues' + suffix] = np.round(history['sales' + suffix] * 0.1 + subscription * n_periods[suffix], 2)
+            history['profits' + suffix] = history['revenues' + suffix] - history['costs' + suffix]
+        metrics = ['n_orders', 'sales', 'review_score', 'delay_to_carrier', 'costs', 'revenues', 'profits']
+        return history[['seller_id', 'period'] + metrics + [metric + '_rolling' for metric in metrics]]
 
@@ -0,0 +1,310 @@
+import os
+import json
+import time
+import socket
+import argparse
+import threading
+import http.client
+import socketserver
+import urllib.error
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pandas as pd
+from olist.data import Olist
+from olist.order import Order
+from olist.seller import Seller
+from olist.product import Product
+
+PORT = 8765
+# seconds between two checks of the csv files
+RELOAD_INTERVAL = 5
+CLASSES = {'order': (Order, 'order_id'), 'seller': (Seller, 'seller_id'), 'product': (Product, 'product_id')}
+
+
+def get_list(params, name):
+    """
+    Returns the list of strings `params[name]`, or None when it is missing.
+    Raises a ValueError for any other value.
+    """
+    value = params.get(name)
+    if value is None:
+        return None
+    if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        raise ValueError('%s should be a list of strings' % name)
+    return value
+
+
+def data_signature():
+    """
+    Returns the (mtime, size) of each Olist csv file, to detect changes on disk.
+    """
+    olist = Olist()
+    csv_path = olist.get_store().csv_path
+    signature = {}
+    for file in olist.FILE_NAMES:
+        stat = os.stat(os.path.join(csv_path, file))
+        signature[file] = (stat.st_mtime_ns, stat.st_size)
+    return signature
+
+
+class FeatureService:
+    '''
+    Keeps an Order, Seller and Product in memory with the frames computed from them,
+    indexed by id, so a request for a few ids is a lookup.
+    Frames are computed once per dataset version; `reload` drops them after the csv files changed.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._frame_locks = {}
+        self.reload()
+
+    def reload(self):
+        """
+        Forgets the parsed tables and computed frames, the next requests read the csv files again.
+        """
+        Olist().clear_cache()
+        with self._lock:
+            self.signature = data_signature()
+            self.objects = {}
+            self.frames = {}
+            self.loaded_at = time.time()
+
+    def reload_if_changed(self):
+        """
+        Reloads when a csv file changed since the last load. Returns True if it did.
+        """
+        if data_signature() == self.signature:
+            return False
+        self.reload()
+        return True
+
+    def get_object(self, kind):
+        if kind not in CLASSES:
+            raise KeyError('Unknown class %r, should be one of %s' % (kind, list(CLASSES)))
+        with self._lock:
+            if kind not in self.objects:
+                self.objects[kind] = CLASSES[kind][0]()
+            return self.objects[kind]
+
+    def get_frame(self, kind, columns=None):
+        """
+        Returns the training data of `kind` ('order', 'seller' or 'product'), or its
+        feature `columns`, indexed by id. Concurrent requests for the same frame compute it once.
+        """
+        key = (kind, None if columns is None else tuple(columns))
+        with self._lock:
+            if key in self.frames:
+                return self.frames[key]
+            lock = self._frame_locks.setdefault(key, threading.Lock())
+        with lock:
+            with self._lock:
+                if key in self.frames:
+                    return self.frames[key]
+                frames = self.frames
+            obj = self.get_object(kind)
+            df = obj.get_training_data() if columns is None else obj.get_features(list(columns))
+            df = df.set_index(CLASSES[kind][1])
+            with self._lock:
+                # a reload while computing replaced the frames, this one is stale
+                if frames is self.frames:
+                    self.frames[key] = df
+            return df
+
+    def lookup(self, kind, ids=None, columns=None):
+        """
+        Returns a DataFrame with the rows of `ids` (all of them when None) in the training data
+        of `kind`, or in its feature `columns`. Ids without a row are left out.
+        """
+        df = self.get_frame(kind, columns)
+        if ids is not None:
+            # looked up in the hash table of the index, not compared to every row
+            df = df.loc[df.index.intersection(ids)]
+        return df.reset_index()
+
+    def status(self):
+        return {'loaded_at': self.loaded_at, 'frames': ['%s %s' % key for key in self.frames],
+                'tables': Olist().get_store().cached_tables()}
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    '''
+    JSON API of the FeatureService:
+    GET /training/<class>?ids=a,b    rows of get_training_data for these ids
+    GET /features/<class>?columns=x,y&ids=a,b    feature columns for these ids
+    GET /status, POST /reload
+    POST /training/<class> and /features/<class> take {"ids": [...], "columns": [...]} as body.
+    '''
+
+    service = None
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        params = {name: ','.join(values).split(',') for name, values in query.items()}
+        self.respond(url.path, params)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            params = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return self.send_json(400, {'error': 'The body should be JSON'})
+        if not isinstance(params, dict):
+            return self.send_json(400, {'error': 'The body should be a JSON object'})
+        self.respond(urllib.parse.urlparse(self.path).path, params)
+
+    def respond(self, path, params):
+        parts = path.strip('/').split('/')
+        try:
+            if parts == ['status']:
+                return self.send_json(200, self.service.status())
+            if parts == ['reload'] and self.command == 'POST':
+                self.service.reload()
+                return self.send_json(200, self.service.status())
+            if len(parts) == 2 and parts[0] in ['training', 'features']:
+                columns = get_list(params, 'columns') if parts[0] == 'features' else None
+                if parts[0] == 'features' and not columns:
+                    return self.send_json(400, {'error': 'features need columns'})
+                df = self.service.lookup(parts[1], get_list(params, 'ids'), columns)
+                return self.send_json(200, json.loads(df.to_json(orient='records', date_format='iso')))
+        except KeyError as error:
+            return self.send_json(400, {'error': str(error.args[0])})
+        except ValueError as error:
+            return self.send_json(400, {'error': str(error)})
+        self.send_json(404, {'error': 'Unknown path %s' % path})
+
+    def send_json(self, code, body):
+        content = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def address_string(self):
+        # unix sockets have no client address
+        return self.client_address[0] if self.client_address else 'unix'
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def watch(service, interval, stop):
+    while not stop.wait(interval):
+        try:
+            service.reload_if_changed()
+        except OSError:
+            # a csv being rewritten, checked again next time
+            pass
+
+
+def serve(host='127.0.0.1', port=PORT, socket=None, interval=RELOAD_INTERVAL, warm=True):
+    """
+    Serves the FeatureService over HTTP on `host`:`port`, or on the unix socket `socket`,
+    each request in its own thread. The csv files are checked every `interval` seconds
+    and the frames reloaded when they changed. `warm` computes the training data before serving.
+    """
+    service = FeatureService()
+    if warm:
+        for kind in CLASSES:
+            service.get_frame(kind)
+    handler = type('Handler', (RequestHandler,), {'service': service})
+    if socket is not None:
+        if os.path.exists(socket):
+            os.remove(socket)
+        server = ThreadingUnixHTTPServer(socket, handler)
+    else:
+        server = ThreadingHTTPServer((host, port), handler)
+    stop = threading.Event()
+    threading.Thread(target=watch, args=(service, interval, stop), daemon=True).start()
+    try:
+        server.serve_forever()
+    finally:
+        stop.set()
+        server.server_close()
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    '''
+    HTTPConnection to a server listening on the unix socket `path`.
+    '''
+
+    def __init__(self, path, timeout):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class Client:
+    '''
+    Client of a local `serve()` over HTTP, or over its unix `socket`, returning DataFrames:
+
+        Client().training('seller', ['3442f8959a84dea7ee197c632cb2df15'])
+        Client(socket='/tmp/olist.sock').training('seller')
+
+    Errors of the server raise a urllib.error.HTTPError.
+    '''
+
+    def __init__(self, url='http://127.0.0.1:%d' % PORT, timeout=60, socket=None):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.socket = socket
+
+    def connect(self):
+        if self.socket is not None:
+            return UnixHTTPConnection(self.socket, self.timeout)
+        url = urllib.parse.urlsplit(self.url)
+        return http.client.HTTPConnection(url.hostname, url.port, timeout=self.timeout)
+
+    def post(self, path, body):
+        connection = self.connect()
+        try:
+            connection.request('POST', urllib.parse.urlsplit(self.url).path + path, json.dumps(body),
+                               {'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            content = json.loads(response.read())
+        finally:
+            connection.close()
+        if response.status != 200:
+            raise urllib.error.HTTPError(self.url + path, response.status, content.get('error'),
+                                         response.headers, None)
+        return content
+
+    def training(self, kind, ids=None):
+        """
+        Returns the training data rows of the `ids` of `kind` ('order', 'seller' or 'product').
+        """
+        return pd.DataFrame(self.post('/training/%s' % kind, {'ids': None if ids is None else list(ids)}))
+
+    def features(self, kind, columns, ids=None):
+        """
+        Returns the feature `columns` of the `ids` of `kind`, e.g.
+        `features('order', ['distance_seller_customer'], order_ids)`.
+        """
+        return pd.DataFrame(self.post('/features/%s' % kind, {'columns': list(columns),
+                                                              'ids': None if ids is None else list(ids)}))
+
+    def reload(self):
+        return self.post('/reload', {})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the Olist training data and features from memory.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--socket', help='serve on this unix socket instead of host:port')
+    parser.add_argument('--interval', type=float, default=RELOAD_INTERVAL,
+                        help='seconds between two checks of the csv files')
+    parser.add_argument('--no-warm', action='store_true', help='compute the frames on first request')
+    args = parser.parse_args()
+    serve(args.host, args.port, args.socket, args.interval, not args.no_warm)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+import os
+import threading
+from collections import OrderedDict
+import pandas as pd
+from olist.cache import ColumnarCache
+from olist.ids import ID_COLUMNS, ID_DICTIONARY, IdRange
+from olist.schema import apply_schema
+from olist.profiling import stage, rows_read
+
+
+class DataStore:
+    '''
+    Process-wide store of the Olist tables: each file is parsed once and
+    every consumer receives the same DataFrame.
+    Files are read through the parquet cache when pyarrow is installed.
+    The id columns of the cached frames hold the integer codes of `ID_DICTIONARY`.
+    Frames handed out by the store are shared, callers must not modify them in place.
+    '''
+
+    CHUNKSIZE = 100000
+
+    def __init__(self, csv_path, max_bytes=None):
+        self.csv_path = csv_path
+        self.max_bytes = max_bytes
+        self.version = 0
+        self.cache = ColumnarCache(csv_path) if ColumnarCache.is_available() else None
+        self._tables = OrderedDict()
+        self._sizes = {}
+        self._columns = {}
+        self._derived = {}
+        self._lock = threading.RLock()
+
+    def get_table(self, file, columns=None):
+        """
+        Returns the DataFrame for `file`, parsing it on first access only.
+        When `columns` is given only these columns are read, columns
+        requested later are read on their own and added to the cached frame.
+        """
+        all_columns = self.get_columns(file)
+        wanted = all_columns if columns is None else list(columns)
+        with stage('get_table ' + file, 'store') as current, self._lock:
+            if file in self._tables:
+                self._tables.move_to_end(file)
+                df = self._tables[file]
+                missing = [c for c in wanted if c not in df.columns]
+                if not missing:
+                    rows_read(len(df))
+                    return current.output(self.project(df, wanted))
+                df = pd.concat([df, self.intern(self.read(file, missing))], axis=1)
+                df = df[[c for c in all_columns if c in df.columns]]
+            else:
+                df = self.intern(self.read(file, None if columns is None else wanted))
+            self._tables[file] = df
+            self._sizes[file] = int(df.memory_usage(deep=True).sum())
+            self.evict()
+            rows_read(len(df))
+            return current.output(self.project(df, wanted))
+
+    def get_filtered(self, file, columns, column, values):
+        """
+        Returns the rows of `file` whose `column` is in `values`
+        (codes for the id columns, or an IdRange of ids).
+        The filter is applied in memory when the table is cached,
+        otherwise while reading, without caching the full table.
+        """
+        wanted = self.get_columns(file) if columns is None else list(columns)
+        read_columns = wanted if column in wanted else wanted + [column]
+        with stage('get_filtered ' + file, 'store') as current:
+            with self._lock:
+                df = self._tables.get(file)
+            if df is not None and all(c in df.columns for c in read_columns):
+                if isinstance(values, IdRange):
+                    df = df[values.contains(ID_DICTIONARY.decode(column, df[column].values))]
+                else:
+                    df = df[df[column].isin(values)]
+            else:
+                if column in ID_COLUMNS and not isinstance(values, IdRange):
+                    values = ID_DICTIONARY.decode(column, values)
+                df = self.intern(self.read(file, read_columns, (column, values)))
+            rows_read(len(df))
+            return current.output(self.project(df, wanted))
+
+    def get_derived(self, name, file, build):
+        """
+        Returns the DataFrame `build()` computes from `file`. It is built once,
+        then kept in memory and persisted in the parquet cache when available.
+        """
+        with self._lock:
+            if name not in self._derived:
+                if self.cache is not None:
+                    self._derived[name] = self.cache.read_derived(name, file, build)
+                else:
+                    self._derived[name] = build()
+            return self._derived[name]
+
+    def put(self, file, df):
+        """
+        Replaces the table of `file` with `df`, holding all its columns,
+        e.g. a partition of it computed by a worker.
+        """
+        with self._lock:
+            self.invalidate(file)
+            df = self.intern(df)
+            self._tables[file] = df
+            self._sizes[file] = int(df.memory_usage(deep=True).sum())
+            self._columns[file] = list(df.columns)
+
+    @staticmethod
+    def intern(df):
+        return ID_DICTIONARY.encode_frame(df)
+
+    @staticmethod
+    def project(df, columns):
+        if list(df.columns) == columns:
+            return df
+        return df[columns]
+
+    def get_columns(self, file):
+        """
+        Returns the column names of `file` without loading it.
+        """
+        if file not in self._columns:
+            if self.cache is not None:
+                self._columns[file] = self.cache.columns(file)
+            else:
+                path = os.path.join(self.csv_path, file)
+                self._columns[file] = list(pd.read_csv(path, nrows=0).columns)
+        return self._columns[file]
+
+    def read(self, file, columns=None, row_filter=None):
+        """
+        Reads `file` from disk, typed as declared in `olist.schema.SCHEMA`.
+        `row_filter` is a (column, values) pair applied chunk by chunk,
+        so only the matching rows are kept in memory.
+        """
+        if self.cache is not None:
+            with stage('read ' + file, 'io') as current:
+                df = current.output(self.cache.read(file, columns, row_filter))
+            return apply_schema(file, df)
+        path = os.path.join(self.csv_path, file)
+        with stage('read_csv ' + file, 'io') as current:
+            if row_filter is None:
+                df = pd.read_csv(path, usecols=columns)
+            else:
+                column, values = row_filter
+                chunks = pd.read_csv(path, usecols=columns, chunksize=self.CHUNKSIZE)
+                df = pd.concat([chunk[values.contains(chunk[column]) if isinstance(values, IdRange)
+                                      else chunk[column].isin(values)] for chunk in chunks],
+                               ignore_index=True)
+            current.output(df)
+        df = apply_schema(file, df)
+        return df if columns is None else df[columns]
+
+    def iter_chunks(self, file, columns, chunksize=None, sorted_by=None):
+        """
+        Yields `file` restricted to `columns` as DataFrames of `chunksize` rows,
+        in file order or sorted on the column `sorted_by`, without caching them.
+        Without the parquet cache, sorting reads the whole `columns` first.
+        """
+        chunksize = chunksize or self.CHUNKSIZE
+        if self.cache is not None:
+            chunks = self.cache.iter_batches(file, columns, chunksize, sorted_by)
+        elif sorted_by is not None:
+            df = pd.read_csv(os.path.join(self.csv_path, file), usecols=columns)
+            df = df.sort_values(sorted_by, kind='stable', ignore_index=True)
+            chunks = (df[start:start + chunksize] for start in range(0, len(df), chunksize))
+        else:
+            chunks = pd.read_csv(os.path.join(self.csv_path, file), usecols=columns, chunksize=chunksize)
+        for chunk in chunks:
+            yield apply_schema(file, chunk)[columns]
+
+    def evict(self):
+        """
+        Drops the least recently used tables until the store fits in `max_bytes`.
+        The most recently used table is always kept.
+        """
+        if self.max_bytes is None:
+            return
+        with self._lock:
+            while len(self._tables) > 1 and self.memory_usage() > self.max_bytes:
+                file, _ = self._tables.popitem(last=False)
+                del self._sizes[file]
+
+    def invalidate(self, file=None):
+        """
+        Forgets `file`, or every table when no file is given,
+        so that the next access parses it again.
+        """
+        with self._lock:
+            if file is None:
+                self._tables.clear()
+                self._sizes.clear()
+                self._columns.clear()
+                self._derived.clear()
+            else:
+                self._tables.pop(file, None)
+                self._sizes.pop(file, None)
+                self._columns.pop(file, None)
+                self._derived.clear()
+            self.version += 1
+
+    def memory_usage(self):
+        """
+        Returns the number of bytes held by the cached tables.
+        """
+        return sum(self._sizes.values())
+
+    def cached_tables(self):
+        return list(self._tables)
+
+
+_STORES = {}
+_STORES_LOCK = threading.Lock()
+
+
+def get_store(csv_path):
+    """
+    Returns the process-wide DataStore reading from `csv_path`.
+    Its memory cap is read from the OLIST_STORE_MAX_BYTES environment variable.
+    """
+    csv_path = os.path.realpath(csv_path)
+    with _STORES_LOCK:
+        if csv_path not in _STORES:
+            max_bytes = os.environ.get('OLIST_STORE_MAX_BYTES')
+            _STORES[csv_path] = DataStore(csv_path,
+                                          int(max_bytes) if max_bytes else None)
+        return _STORES[csv_path]
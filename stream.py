@@ -0,0 +1,62 @@
+import os
+from olist.data import Olist
+from olist.order import Order
+from olist.ids import ID_DICTIONARY, IdRange, sort_ids
+from olist.cache import pyarrow
+
+CHUNKSIZE = 50000
+
+
+def iter_order_ranges(chunksize=CHUNKSIZE):
+    """
+    Yields IdRanges of `chunksize` order ids each, in sorted order, covering every order:
+    the first one has no lower bound and the last one no upper bound.
+    """
+    store = Olist().get_store()
+    low = None
+    for i, chunk in enumerate(store.iter_chunks('olist_orders_dataset.csv', ['order_id'], chunksize,
+                                                sorted_by='order_id')):
+        if i > 0:
+            high = chunk['order_id'].iloc[0]
+            yield IdRange('order_id', low, high)
+            low = high
+    yield IdRange('order_id', low)
+
+
+def iter_training_data(chunksize=CHUNKSIZE, **kwargs):
+    """
+    Yields `Order().get_training_data(**kwargs)` one chunk of `chunksize` orders at a time,
+    in order_id ranges. Each chunk reads its orders, items and reviews as a range of their copies
+    sorted by order_id (pruned to the row groups holding it), and the matching customers and sellers
+    with filtered reads, which do not cache the tables. The ids a chunk interns are forgotten after it,
+    so memory does not grow with the data.
+    Concatenated, the chunks hold the rows of the full training set, sorted by order_id.
+    """
+    store = Olist().get_store()
+    for order_ids in iter_order_ranges(chunksize):
+        cached = set(store.cached_tables())
+        with ID_DICTIONARY.scope():
+            chunk = Order(order_ids).get_training_data(**kwargs)
+            # a table cached while the chunk ran holds codes forgotten with it
+            for file in set(store.cached_tables()) - cached:
+                store.invalidate(file)
+        # already sorted when read from the sorted parquet copies
+        yield sort_ids(chunk, 'order_id')
+
+def write_training_data(path, chunksize=CHUNKSIZE, **kwargs):
+    """
+    Writes the chunks of `iter_training_data` in the folder `path`, as
+    part-00000.parquet, part-00001.parquet... (csv files without pyarrow).
+    Returns the list of files written.
+    """
+    os.makedirs(path, exist_ok=True)
+    extension = 'parquet' if pyarrow is not None else 'csv'
+    files = []
+    for i, chunk in enumerate(iter_training_data(chunksize, **kwargs)):
+        file = os.path.join(path, 'part-%05d.%s' % (i, extension))
+        if pyarrow is not None:
+            chunk.to_parquet(file, engine='pyarrow', index=False)
+        else:
+            chunk.to_csv(file, index=False)
+        files.append(file)
+    return files
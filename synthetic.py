@@ -0,0 +1,296 @@
+import os
+import argparse
+import numpy as np
+import pandas as pd
+from olist.data import Olist
+from olist.schema import DATETIME_FORMAT
+
+# shape of the public Olist dataset (about 100k orders), the 1x scale:
+# table sizes and the distributions of the key relationships
+PROFILE = {
+    'n_orders': 99441,
+    'n_sellers': 3095,
+    'n_products': 32951,
+    'n_zip_prefixes': 19015,
+    'repeat_customers': 0.034,
+    'first_purchase': '2016-09-04',
+    'last_purchase': '2018-10-17',
+    'items_per_order': {0: 775, 1: 88863, 2: 7516, 3: 1322, 4: 505, 5: 204, 6: 198, 7: 22, 8: 8,
+                        9: 3, 10: 8, 11: 4, 12: 5, 13: 1, 14: 2, 15: 2, 20: 2, 21: 1},
+    'reviews_per_order': {0: 768, 1: 98126, 2: 543, 3: 4},
+    'payments_per_order': {0: 1, 1: 96479, 2: 2382, 3: 301, 4: 108, 5: 52, 6: 36, 7: 28, 8: 11, 9: 9, 10: 5},
+    'geolocation_rows_per_zip': {1: 2500, 2: 1300, 5: 2900, 10: 2800, 25: 3300, 50: 2500,
+                                 100: 1800, 250: 1300, 500: 480, 1000: 100, 1146: 35},
+    'order_status': {'delivered': 96478, 'shipped': 1107, 'canceled': 625, 'unavailable': 609,
+                     'invoiced': 314, 'processing': 301, 'created': 5, 'approved': 2},
+    'review_score': {5: 57420, 4: 19200, 1: 11858, 3: 8287, 2: 3235},
+    'late_review_score': {5: 1600, 4: 700, 1: 3500, 3: 900, 2: 500},
+    'payment_type': {'credit_card': 76795, 'boleto': 19784, 'voucher': 5775, 'debit_card': 1529, 'not_defined': 3},
+    'payment_installments': {1: 52546, 2: 12413, 3: 10461, 4: 7098, 5: 5239, 6: 3920, 7: 1626,
+                             8: 4268, 9: 644, 10: 5328, 12: 133, 15: 74, 18: 27, 24: 18},
+    # share of the items of an order repeating the product of the previous item
+    'repeated_product': 0.7,
+    'n_categories': 73,
+    'n_translated_categories': 71,
+    'missing_category': 0.0185,
+}
+
+# first two digits of the zip prefix to state, from the Brazilian CEP ranges
+STATES = [(0, 'SP'), (20, 'RJ'), (29, 'ES'), (30, 'MG'), (40, 'BA'), (49, 'SE'), (50, 'PE'), (57, 'AL'),
+          (58, 'PB'), (59, 'RN'), (60, 'CE'), (64, 'PI'), (65, 'MA'), (66, 'PA'), (68, 'AP'), (69, 'AM'),
+          (70, 'DF'), (73, 'GO'), (77, 'TO'), (78, 'MT'), (79, 'MS'), (80, 'PR'), (88, 'SC'), (90, 'RS')]
+CHUNKSIZE = 100000
+
+
+def counts(series):
+    return {int(k) if isinstance(k, (int, np.integer)) else k: int(v)
+            for k, v in series.value_counts().sort_index().items()}
+
+
+def measure_profile(data=None):
+    """
+    Returns a profile like PROFILE measured on `data` (a dict like `Olist().get_data()`),
+    so that generated data follows the distributions of a real dataset.
+    """
+    data = Olist().get_data() if data is None else data
+    orders = data['orders']
+    profile = dict(PROFILE)
+    per_order = lambda df: df.groupby('order_id').size().reindex(orders['order_id'], fill_value=0)
+    profile.update({
+        'n_orders': len(orders),
+        'n_sellers': len(data['sellers']),
+        'n_products': len(data['products']),
+        'n_zip_prefixes': data['geolocation']['geolocation_zip_code_prefix'].nunique(),
+        'repeat_customers': 1 - data['customers']['customer_unique_id'].nunique() / len(data['customers']),
+        'first_purchase': str(orders['order_purchase_timestamp'].min().date()),
+        'last_purchase': str(orders['order_purchase_timestamp'].max().date()),
+        'items_per_order': counts(per_order(data['order_items'])),
+        'reviews_per_order': counts(per_order(data['order_reviews'])),
+        'payments_per_order': counts(per_order(data['order_payments'])),
+        'geolocation_rows_per_zip': counts(data['geolocation'].groupby('geolocation_zip_code_prefix').size()),
+        'order_status': counts(orders['order_status'].astype(object)),
+        'review_score': counts(data['order_reviews']['review_score']),
+        'payment_type': counts(data['order_payments']['payment_type'].astype(object)),
+        'payment_installments': counts(data['order_payments']['payment_installments']),
+        'n_categories': data['products']['product_category_name'].nunique(),
+        'n_translated_categories': len(data['product_category_name_translation']),
+        'missing_category': data['products']['product_category_name'].isna().mean(),
+    })
+    return profile
+
+
+class Generator:
+    '''
+    Writes the nine Olist csv files at `scale` times the size of `profile`.
+    Orders, customers, sellers and products grow with the scale, the zip prefixes and their
+    geolocation rows do not (there are only so many zip codes).
+    Every key of a table refers to an existing row of the table it joins.
+    '''
+
+    def __init__(self, path, scale=1, profile=None, seed=0):
+        self.path = path
+        self.scale = scale
+        self.profile = PROFILE if profile is None else profile
+        self.rng = np.random.default_rng(seed)
+
+    def choice(self, distribution, size):
+        values = np.array(list(distribution.keys()))
+        weights = np.array(list(distribution.values()), dtype=float)
+        return values[self.rng.choice(len(values), size, p=weights / weights.sum())]
+
+    def ids(self, n):
+        return np.frombuffer(self.rng.bytes(16 * n).hex().encode(), dtype='S32').astype(str)
+
+    def popularity(self, n):
+        weights = self.rng.lognormal(0, 1.5, n)
+        return weights / weights.sum()
+
+    @staticmethod
+    def dates(values, missing=None):
+        text = pd.Series(pd.to_datetime(values)).dt.strftime(DATETIME_FORMAT)
+        return text.where(~missing) if missing is not None else text
+
+    def comments(self, text, share, n):
+        return pd.Series(text, index=range(n)).where(self.rng.random(n) < share)
+
+    def write(self, name, df, append=False):
+        df.to_csv(os.path.join(self.path, name), index=False, mode='a' if append else 'w', header=not append)
+
+    def generate(self, chunksize=CHUNKSIZE):
+        """
+        Writes the csv files, the orders `chunksize` at a time. Returns the number of rows per file.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        rows = {}
+        self.zips = self.generate_geolocation(rows)
+        self.generate_products(rows)
+        self.generate_sellers(rows)
+        n_orders = int(round(self.profile['n_orders'] * self.scale))
+        for start in range(0, n_orders, chunksize):
+            self.generate_orders(min(chunksize, n_orders - start), start > 0, rows)
+        return rows
+
+    def generate_geolocation(self, rows):
+        n_zips = self.profile['n_zip_prefixes']
+        zips = np.sort(self.rng.choice(np.arange(1001, 99991), n_zips, replace=False))
+        states = np.array([state for _, state in STATES])[np.searchsorted([start for start, _ in STATES], zips // 1000, side='right') - 1]
+        n_rows = self.choice(self.profile['geolocation_rows_per_zip'], n_zips)
+        # one position per zip prefix, its rows scattered around it
+        lat = self.rng.uniform(-33, 2, n_zips)
+        lng = self.rng.uniform(-70, -35, n_zips)
+        zip_rows = np.repeat(np.arange(n_zips), n_rows)
+        geolocation = pd.DataFrame({'geolocation_zip_code_prefix': zips[zip_rows],
+                                    'geolocation_lat': lat[zip_rows] + self.rng.normal(0, 0.02, len(zip_rows)),
+                                    'geolocation_lng': lng[zip_rows] + self.rng.normal(0, 0.02, len(zip_rows)),
+                                    'geolocation_city': ['city_%d' % (zip // 100) for zip in zips[zip_rows]],
+                                    'geolocation_state': states[zip_rows]})
+        self.write('olist_geolocation_dataset.csv', geolocation)
+        rows['olist_geolocation_dataset.csv'] = len(geolocation)
+        # busy zip prefixes have more geolocation rows and more customers
+        return pd.DataFrame({'zip': zips, 'state': states, 'weight': n_rows / n_rows.sum()})
+
+    def pick_zips(self, n):
+        picked = self.zips.iloc[self.rng.choice(len(self.zips), n, p=self.zips['weight'].values)]
+        return picked['zip'].values, picked['state'].values, np.array(['city_%d' % (zip // 100) for zip in picked['zip']])
+
+    def generate_products(self, rows):
+        n_categories = self.profile['n_categories']
+        categories = np.array(['category_%d' % i for i in range(n_categories)])
+        translation = pd.DataFrame({'product_category_name': categories[:self.profile['n_translated_categories']]})
+        translation['product_category_name_english'] = translation['product_category_name'] + '_en'
+        self.write('product_category_name_translation.csv', translation)
+        rows['product_category_name_translation.csv'] = len(translation)
+
+        n = int(round(self.profile['n_products'] * self.scale))
+        category = categories[self.rng.choice(n_categories, n, p=self.popularity(n_categories))].astype(object)
+        category[self.rng.random(n) < self.profile['missing_category']] = np.nan
+        sizes = lambda low, high: np.round(np.exp(self.rng.uniform(np.log(low), np.log(high), n)))
+        self.products = pd.DataFrame({'product_id': self.ids(n),
+                                      'product_category_name': category,
+                                      'product_name_lenght': self.rng.integers(5, 77, n).astype(float),
+                                      'product_description_lenght': sizes(4, 3992),
+                                      'product_photos_qty': self.rng.choice([1, 1, 1, 2, 2, 3, 4, 5, 6], n).astype(float),
+                                      'product_weight_g': sizes(50, 40425),
+                                      'product_length_cm': sizes(7, 105),
+                                      'product_height_cm': sizes(2, 105),
+                                      'product_width_cm': sizes(6, 118)})
+        self.products.loc[pd.isna(category), ['product_name_lenght', 'product_description_lenght',
+                                              'product_photos_qty']] = np.nan
+        self.write('olist_products_dataset.csv', self.products)
+        rows['olist_products_dataset.csv'] = n
+        self.product_weights = self.popularity(n)
+        self.product_prices = np.round(self.rng.lognormal(np.log(75), 0.9, n), 2)
+
+    def generate_sellers(self, rows):
+        n = int(round(self.profile['n_sellers'] * self.scale))
+        zips, states, cities = self.pick_zips(n)
+        sellers = pd.DataFrame({'seller_id': self.ids(n), 'seller_zip_code_prefix': zips,
+                                'seller_city': cities, 'seller_state': states})
+        self.write('olist_sellers_dataset.csv', sellers)
+        rows['olist_sellers_dataset.csv'] = n
+        # each product is sold by one seller, popular sellers list more products
+        self.product_sellers = sellers['seller_id'].values[
+            self.rng.choice(n, len(self.products), p=self.popularity(n))]
+
+    def generate_orders(self, n, append, rows):
+        rng = self.rng
+        order_id = self.ids(n)
+        zips, states, cities = self.pick_zips(n)
+        unique_ids = self.ids(n)
+        repeat = rng.random(n) < self.profile['repeat_customers']
+        unique_ids[repeat] = unique_ids[rng.integers(0, n, repeat.sum())]
+        customers = pd.DataFrame({'customer_id': self.ids(n), 'customer_unique_id': unique_ids,
+                                  'customer_zip_code_prefix': zips, 'customer_city': cities,
+                                  'customer_state': states})
+
+        # purchases grow over the period, as the marketplace did
+        first, last = pd.Timestamp(self.profile['first_purchase']), pd.Timestamp(self.profile['last_purchase'])
+        purchase = first.value + np.sqrt(rng.random(n)) * (last.value - first.value)
+        status = self.choice(self.profile['order_status'], n)
+        day = 86400 * 10 ** 9
+        approved = purchase + rng.exponential(0.4 * day, n)
+        carrier = approved + rng.gamma(2, 1.5 * day, n)
+        delivered = carrier + rng.gamma(2, 4.5 * day, n)
+        estimated = pd.to_datetime(purchase + rng.normal(24, 8, n).clip(3) * day).normalize()
+        orders = pd.DataFrame({'order_id': order_id, 'customer_id': customers['customer_id'].values,
+                               'order_status': status,
+                               'order_purchase_timestamp': self.dates(purchase),
+                               'order_approved_at': self.dates(approved, np.isin(status, ['created']) | (rng.random(n) < 0.0015)),
+                               'order_delivered_carrier_date': self.dates(carrier, ~np.isin(status, ['delivered', 'shipped'])),
+                               'order_delivered_customer_date': self.dates(delivered, status != 'delivered'),
+                               'order_estimated_delivery_date': self.dates(estimated)})
+
+        n_items = self.choice(self.profile['items_per_order'], n)
+        item_order = np.repeat(np.arange(n), n_items)
+        first_item = np.concatenate([[0], np.cumsum(n_items)[:-1]])
+        order_item_id = np.arange(len(item_order)) - first_item[item_order] + 1
+        products = rng.choice(len(self.products), len(item_order), p=self.product_weights)
+        repeated = (order_item_id > 1) & (rng.random(len(item_order)) < self.profile['repeated_product'])
+        # a repeated item takes the product of the first item of its order
+        products[repeated] = products[first_item[item_order[repeated]]]
+        price = np.round(self.product_prices[products] * rng.uniform(0.95, 1.05, len(products)), 2)
+        freight = np.round(rng.gamma(2, 10, len(products)), 2)
+        items = pd.DataFrame({'order_id': order_id[item_order], 'order_item_id': order_item_id,
+                              'product_id': self.products['product_id'].values[products],
+                              'seller_id': self.product_sellers[products],
+                              'shipping_limit_date': self.dates(approved[item_order] + 6 * day),
+                              'price': price, 'freight_value': freight})
+
+        n_reviews = self.choice(self.profile['reviews_per_order'], n)
+        review_order = np.repeat(np.arange(n), n_reviews)
+        late = (delivered > estimated.values.astype(np.int64))[review_order] & (status[review_order] == 'delivered')
+        score = self.choice(self.profile['review_score'], len(review_order))
+        score[late] = self.choice(self.profile['late_review_score'], late.sum())
+        created = pd.to_datetime(np.where(status[review_order] == 'delivered', delivered[review_order],
+                                          estimated.values.astype(np.int64)[review_order]) + day).normalize()
+        answered = created.values.astype(np.int64) + rng.gamma(1.5, 2 * day, len(review_order))
+        reviews = pd.DataFrame({'review_id': self.ids(len(review_order)), 'order_id': order_id[review_order],
+                                'review_score': score,
+                                'review_comment_title': self.comments('title', 0.12, len(review_order)),
+                                'review_comment_message': self.comments('message', 0.41, len(review_order)),
+                                'review_creation_date': self.dates(created),
+                                'review_answer_timestamp': self.dates(answered)})
+
+        n_payments = self.choice(self.profile['payments_per_order'], n)
+        payment_order = np.repeat(np.arange(n), n_payments)
+        first_payment = np.concatenate([[0], np.cumsum(n_payments)[:-1]])
+        payment_type = self.choice(self.profile['payment_type'], len(payment_order))
+        installments = np.where(payment_type == 'credit_card',
+                                self.choice(self.profile['payment_installments'], len(payment_order)), 1)
+        totals = np.bincount(item_order, weights=price + freight, minlength=n)
+        payments = pd.DataFrame({'order_id': order_id[payment_order],
+                                 'payment_sequential': np.arange(len(payment_order)) - first_payment[payment_order] + 1,
+                                 'payment_type': payment_type, 'payment_installments': installments,
+                                 'payment_value': np.round(totals[payment_order] / n_payments[payment_order], 2)})
+
+        for name, df in [('olist_customers_dataset.csv', customers), ('olist_orders_dataset.csv', orders),
+                         ('olist_order_items_dataset.csv', items), ('olist_order_reviews_dataset.csv', reviews),
+                         ('olist_order_payments_dataset.csv', payments)]:
+            self.write(name, df, append)
+            rows[name] = rows.get(name, 0) + len(df)
+
+
+def generate(path, scale=1, profile=None, seed=0, chunksize=CHUNKSIZE):
+    """
+    Writes the nine Olist csv files in `path` at `scale` times the size of `profile`
+    (PROFILE, or `measure_profile()` to follow the current dataset).
+    Point OLIST_DATA_DIR to `path` to use them. Returns the number of rows per file.
+    """
+    return Generator(path, scale, profile, seed).generate(chunksize)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic Olist csv files.')
+    parser.add_argument('path', help='folder to write the csv files to')
+    parser.add_argument('--scale', type=float, default=1, help='size relative to the public dataset')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--from-data', action='store_true',
+                        help='follow the distributions of the current dataset instead of the built-in profile')
+    args = parser.parse_args()
+    profile = measure_profile() if args.from_data else None
+    for name, n in generate(args.path, args.scale, profile, args.seed).items():
+        print(name, n)
+
+
+if __name__ == '__main__':
+    main()
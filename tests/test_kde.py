@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+from olist.kde import binned_kde, get_densities, CUT
+
+
+def exact_kde(values, points):
+    bandwidth = values.std(ddof=1) * len(values) ** (-1 / 5)
+    z = (points[:, None] - values[None, :]) / bandwidth
+    return np.exp(-0.5 * z ** 2).sum(axis=1) / (len(values) * bandwidth * np.sqrt(2 * np.pi))
+
+
+def test_facets_of_different_scales():
+    rng = np.random.default_rng(0)
+    narrow = rng.normal(5, 0.01, 500)
+    wide = rng.normal(0, 1000, 500)
+    codes = np.repeat([0, 1], 500)
+    grid, densities = binned_kde(codes, np.concatenate([narrow, wide]), 2, grid_size=256)
+    assert grid.shape == densities.shape == (2, 256)
+    for group, values in enumerate([narrow, wide]):
+        bandwidth = values.std(ddof=1) * len(values) ** (-1 / 5)
+        assert np.isclose(grid[group, 0], values.min() - CUT * bandwidth)
+        assert np.isclose(grid[group, -1], values.max() + CUT * bandwidth)
+        exact = exact_kde(values, grid[group])
+        assert np.abs(densities[group] - exact).max() < 0.01 * exact.max()
+
+
+def test_group_without_spread():
+    grid, densities = binned_kde(np.array([0, 0, 0, 1]), np.array([1., 2., 4., 3.]), 2, grid_size=64)
+    assert np.isfinite(densities[0]).all()
+    assert np.isnan(densities[1]).all()
+
+
+def test_get_densities():
+    df = pd.DataFrame({'facet': ['a'] * 300 + ['b'] * 300,
+                       'value': np.concatenate([np.linspace(0, 1e-3, 300), np.linspace(-1e3, 1e3, 300)])})
+    densities = get_densities(df, 'value', 'facet', grid_size=128)
+    assert densities.groupby('facet').size().tolist() == [128, 128]
+    a = densities[densities['facet'] == 'a']['value']
+    assert a.min() < 0 and a.max() < 1
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+from olist.kernels import star_indicator, review_cost, positive_part, days_late
+
+# scores with the 3/4 and 4/5 boundaries, a missing score and a float dtype as read with NaN
+SCORES = pd.Series([1, 2, 3, 4, 5, np.nan, 3.0, 4.0, 5.0, 1.0], index=range(10, 20))
+
+
+def dim_five_star(x):
+    if x == 5:
+        return 1
+    return 0
+
+
+def dim_one_star(x):
+    if x == 1:
+        return 1
+    return 0
+
+
+def cost_of_bad_reviews(x):
+    return 100 if x == 1 else (50 if x == 2 else (40 if x == 3 else 0))
+
+
+def delay(x):
+    if x > 0:
+        return abs(x)
+    return 0
+
+
+def test_star_indicator():
+    pd.testing.assert_series_equal(star_indicator(SCORES, 5), SCORES.map(dim_five_star), check_dtype=False)
+    pd.testing.assert_series_equal(star_indicator(SCORES, 1), SCORES.map(dim_one_star), check_dtype=False)
+
+
+def test_star_indicator_int8_scores():
+    scores = pd.Series([1, 3, 4, 5], dtype='int8')
+    pd.testing.assert_series_equal(star_indicator(scores, 5), scores.map(dim_five_star), check_dtype=False)
+
+
+def test_review_cost():
+    pd.testing.assert_series_equal(review_cost(SCORES), SCORES.map(cost_of_bad_reviews), check_dtype=False)
+
+
+def test_positive_part():
+    values = pd.Series([2.5, 0.0, -0.0, -3.2, np.nan, 1e-9, -1e-9])
+    pd.testing.assert_series_equal(positive_part(values), values.map(delay), check_dtype=False)
+
+
+def test_days_late():
+    actual = pd.to_datetime(pd.Series(['2018-01-05', '2018-01-01', '2018-01-03', None, '2018-01-02 12:00:00', '2018-01-04']))
+    expected = pd.to_datetime(pd.Series(['2018-01-03', '2018-01-03', '2018-01-03', '2018-01-03', '2018-01-02', None]))
+    delays = (actual - expected).dt.total_seconds() / 3600 / 24
+
+    # the chained assignment it replaces
+    baseline = delays.copy()
+    baseline[actual < expected] = 0
+
+    result = days_late(delays, actual, expected)
+    pd.testing.assert_series_equal(result, baseline)
+    assert result.tolist()[:3] == [2.0, 0.0, 0.0]
+    assert np.isnan(result[3]) and np.isnan(result[5])
@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+import pytest
+from olist import regression
+from olist.regression import fit_groups, group_gram, weighted_gram
+
+smf = pytest.importorskip('statsmodels.formula.api')
+
+
+def make_frame(n=600, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({'x1': rng.normal(size=n), 'x2': rng.exponential(size=n),
+                       'state': pd.Categorical(rng.choice(['RJ', 'SP', 'MG'], n)),
+                       'group': rng.integers(0, 3, n)})
+    df['y'] = 1 + 2 * df['x1'] - df['x2'] + (df['state'] == 'SP') + rng.normal(size=n)
+    df.loc[::50, 'x1'] = np.nan
+    return df
+
+
+def assert_matches_statsmodels(table, df):
+    fit = smf.ols('y ~ x1 + x2 + state', df).fit()
+    ci = fit.conf_int()
+    table = table.set_index('variable').loc[fit.params.index]
+    np.testing.assert_allclose(table['coef'], fit.params, rtol=1e-10, atol=1e-10)
+    np.testing.assert_allclose(table['std_err'], fit.bse, rtol=1e-10, atol=1e-10)
+    np.testing.assert_allclose(table['p_value'], fit.pvalues, rtol=1e-8, atol=1e-10)
+    np.testing.assert_allclose(table['ci_low'], ci[0], rtol=1e-10, atol=1e-10)
+    np.testing.assert_allclose(table['ci_high'], ci[1], rtol=1e-10, atol=1e-10)
+
+
+def test_fit_matches_statsmodels():
+    df = make_frame()
+    assert_matches_statsmodels(fit_groups(df, 'y', ['x1', 'x2', 'state']), df)
+
+
+def test_groups_match_statsmodels(monkeypatch):
+    # a block smaller than a group, so groups span several blocks
+    monkeypatch.setattr(regression, 'BLOCK_SIZE', 7 * 36)
+    df = make_frame()
+    table = fit_groups(df, 'y', ['x1', 'x2', 'state'], by='group')
+    for group, rows in df.groupby('group'):
+        assert_matches_statsmodels(table[table['group'] == group], rows)
+
+
+def test_blocked_gram(monkeypatch):
+    monkeypatch.setattr(regression, 'BLOCK_SIZE', 5 * 9)
+    rng = np.random.default_rng(1)
+    X = rng.normal(size=(103, 3))
+    codes = np.sort(rng.integers(0, 4, 103))
+    expected = np.stack([X[codes == group].T @ X[codes == group] for group in range(4)])
+    np.testing.assert_allclose(group_gram(X, codes, 4), expected)
+    weights = rng.poisson(size=(6, 103)).astype(float)
+    np.testing.assert_allclose(weighted_gram(X, weights), [(X * w[:, None]).T @ X for w in weights])
@@ -1,18 +1,18 @@
-from math import radians, sin, cos, asin, sqrt
-import matplotlib.pyplot as plt
-import seaborn as sns
+import numpy as np
+from olist.kde import get_densities
 
 
 def haversine_distance(lon1, lat1, lon2, lat2):
     """
     Compute distance between two pairs of (lat, lng)
     See - (https://en.wikipedia.org/wiki/Haversine_formula)
+    Accepts scalars or arrays, arrays are broadcast against each other.
     """
-    lon1, lat1, lon2, lat2 = map(radians, [lon1, lat1, lon2, lat2])
+    lon1, lat1, lon2, lat2 = map(np.radians, [lon1, lat1, lon2, lat2])
     dlon = lon2 - lon1
     dlat = lat2 - lat1
-    a = sin(dlat / 2) ** 2 + cos(lat1) * cos(lat2) * sin(dlon / 2) ** 2
-    return 2 * 6371 * asin(sqrt(a))
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * 6371 * np.arcsin(np.sqrt(a))
 
 
 def return_significative_coef(model):
@@ -32,11 +32,24 @@ def return_significative_coef(model):
                    .query("p_value<0.05").sort_values(by='coef',
                                                       ascending=False)
 
-def plot_kde_plot(df, variable, dimension):
+def plot_kde_plot(df, variable, dimension, fast=False, max_samples=None):
     """
     Plot a side by side kdeplot for `variable`, split
     by `dimension`.
+    With `fast=True` the densities of all facets are computed at once on a grid
+    (see olist.kde, cached) and only drawn by seaborn, `max_samples` limits
+    the rows used per value of `dimension`.
+    matplotlib and seaborn are imported on first call, importing olist.utils does not load them.
     """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    if fast:
+        densities = get_densities(df, variable, dimension, max_samples=max_samples)
+        g = sns.FacetGrid(densities,
+                          hue=dimension,
+                          col=dimension)
+        g.map(plt.plot, variable, 'density')
+        return g
     g = sns.FacetGrid(df,
                       hue=dimension,
                       col=dimension)